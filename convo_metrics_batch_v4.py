@@ -1,20 +1,26 @@
 # convo_metrics_batch_v4.py — handles ChatGPT + Claude .txt dumps
 # Drop .txt files into ./input, get per-convo Excel files in ./output
 # Columns produced match the spec in the prompt, including E_score_prompt_shuffle.
+# The scoring core (parse_pairs / score_pairs / ConversationScorer) is stdlib-only; pandas and
+# openpyxl are imported only by the DataFrame/report functions, so importing this module is cheap.
 
-import os, re, math, random
+import os, sys, re, math, random, json, time, argparse, queue, threading, functools, hashlib
 from collections import deque
-import pandas as pd
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:   # annotations only; pandas itself is imported lazily
+    import pandas as pd
 
 # -----------------------------
 # Config
 # -----------------------------
 INPUT_FOLDER  = "input"
-OUTPUT_FOLDER = "output"
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+OUTPUT_FOLDER = "output"  # created by main(), not at import time
 
 CALLBACK_WINDOW = 3
 HOT_THRESHOLD   = 0.55
+E_WEIGHTS       = (0.18, 0.22, 0.20, 0.20, 0.20)  # IA, ST, AC, SC, SN (CP is subtracted as-is)
 RANDOM_SEED     = 42  # deterministic prompt-shuffle control
 
 # Length-bin cutoffs (in tokens, post-stopword)
@@ -210,7 +216,8 @@ def new_glyphs_count(text, seen_glyphs_set):
     return new
 
 def emergence_score(IA, ST, AC, SC, SN, CP):
-    return max(0.0, round(0.18*IA + 0.22*ST + 0.20*AC + 0.20*SC + 0.20*SN - CP, 3))
+    wIA, wST, wAC, wSC, wSN = E_WEIGHTS
+    return max(0.0, round(wIA*IA + wST*ST + wAC*AC + wSC*SC + wSN*SN - CP, 3))
 
 # -----------------------------
 # Parsing transcripts — robust to ChatGPT/Claude exports
@@ -322,6 +329,148 @@ def parse_pairs(text: str):
         i += 2
     return alt_pairs
 
+# -----------------------------
+# Reading transcripts (.txt / .docx / .json)
+# -----------------------------
+def _read_txt(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+_DOCX_TEXT = {"tab": "\t", "ptab": "\t", "br": "\n", "cr": "\n", "noBreakHyphen": "-"}
+_DOCX_W_NS = {"{http://schemas.openxmlformats.org/wordprocessingml/2006/main",   # transitional
+              "{http://purl.oclc.org/ooxml/wordprocessingml/main"}                # strict
+
+def iter_docx_paragraphs(path: str):
+    """Yield the text of each top-level paragraph of a .docx, one at a time.
+
+    Streams word/document.xml straight out of the zip with an incremental parser instead of
+    building python-docx's object model, so memory stays flat on very long transcripts. Like
+    python-docx's Document.paragraphs, only paragraphs directly under <w:body> are yielded
+    (not table cells or text boxes); runs inside hyperlinks and tracked insertions are kept,
+    tracked deletions are not.
+    """
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+    try:
+        zf = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise RuntimeError(f"{os.path.basename(path)} is not a valid .docx (zip) file") from e
+    with zf:
+        try:
+            f = zf.open("word/document.xml")
+        except KeyError as e:
+            raise RuntimeError(f"{os.path.basename(path)} has no word/document.xml; not a Word document") from e
+        with f:
+            stack = []      # local names of the open elements
+            parents = []    # the open elements themselves, to detach finished body children
+            buf = None      # text pieces of the current top-level paragraph
+            for event, el in iterparse(f, events=("start", "end")):
+                ns, _, tag = el.tag.rpartition("}")
+                if ns not in _DOCX_W_NS:
+                    tag = None
+                if event == "start":
+                    if tag == "p" and stack and stack[-1] == "body":
+                        buf = []
+                    stack.append(tag)
+                    parents.append(el)
+                    continue
+                stack.pop()
+                parents.pop()
+                # only run content counts: <w:pPr><w:tabs><w:tab/> are tab-stop definitions, not text;
+                # and skip paragraphs nested in text boxes
+                if buf is not None and stack[-1] == "r" and stack.count("p") == 1:
+                    if tag == "t":
+                        buf.append(el.text or "")
+                    elif tag == "br" and el.get(ns + "}type") in ("page", "column"):
+                        pass   # like python-docx, only line breaks become "\n"
+                    elif tag in _DOCX_TEXT:
+                        buf.append(_DOCX_TEXT[tag])
+                if stack and stack[-1] == "body":
+                    if tag == "p":
+                        yield "".join(buf)
+                        buf = None
+                    parents[-1].remove(el)   # detach finished paragraphs/tables so <w:body> stays empty
+                elif buf is None:
+                    el.clear()   # drop finished subtrees outside paragraphs (e.g. inside tables)
+
+def _read_docx(path: str) -> str:
+    text = "\n".join(iter_docx_paragraphs(path)).strip()
+    return text
+
+def _flatten_openai_contents(content):
+    """OpenAI JSON may have content as string or list of {'type':'text','text':...} blocks."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        out = []
+        for part in content:
+            if isinstance(part, dict):
+                # 'text' for text blocks; assist if name differs
+                if 'text' in part and isinstance(part['text'], str):
+                    out.append(part['text'])
+                elif 'image_url' in part:
+                    out.append("[image]")
+        return "\n".join(out)
+    if isinstance(content, dict) and 'text' in content:
+        return content.get('text','')
+    return str(content)
+
+ROLE_MAP = {
+    'user':'User', 'human':'User', 'system':'User', # treat system as user context
+    'assistant':'Assistant', 'claude':'Assistant', 'model':'Assistant'
+}
+
+def _read_json(path: str) -> str:
+    """Best-effort loader for common ChatGPT/Claude exports.
+    Produces a normalized plain text with explicit headers like 'User:' / 'Assistant:' so the downstream parser works.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    lines = []
+
+    # Case 1: {'messages': [...]} like OpenAI
+    msgs = None
+    if isinstance(data, dict) and isinstance(data.get('messages'), list):
+        msgs = data['messages']
+    elif isinstance(data, list) and data and isinstance(data[0], dict) and 'messages' in data[0]:
+        msgs = data[0]['messages']
+    elif isinstance(data, list):
+        # sometimes the root is already a list of message dicts
+        if all(isinstance(m, dict) and ('role' in m or 'sender' in m) for m in data):
+            msgs = data
+
+    if msgs is not None:
+        for m in msgs:
+            role = m.get('role') or m.get('sender') or m.get('author')
+            role_norm = ROLE_MAP.get(str(role).lower(), 'User' if str(role).lower() in ('system',) else 'Assistant' if str(role).lower() in ('assistant','claude','model') else 'User')
+            content = m.get('content')
+            text = _flatten_openai_contents(content)
+            header = 'User:' if role_norm == 'User' else 'Assistant:'
+            lines.append(f"{header} {text}")
+        return "\n".join(lines)
+
+    # Case 2: Anthropic-style {'type':'message','role':'assistant','content':...}
+    if isinstance(data, dict) and data.get('type') == 'message' and 'role' in data and 'content' in data:
+        role_norm = ROLE_MAP.get(str(data.get('role')).lower(), 'Assistant')
+        text = _flatten_openai_contents(data.get('content'))
+        header = 'Assistant:' if role_norm == 'Assistant' else 'User:'
+        return f"{header} {text}"
+
+    # Case 3: Unknown structure — fallback to raw dump
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def read_convo_from_path(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.txt':
+        return _read_txt(path)
+    if ext == '.docx':
+        return _read_docx(path)
+    if ext == '.json':
+        return _read_json(path)
+    raise ValueError("Unsupported file type: {}".format(ext))
+
 # -----------------------------
 # Extra skeptical markers
 # -----------------------------
@@ -355,54 +504,165 @@ def motif_latency_updates(a_text, motif_last_seen, current_turn):
             latency = min(latencies)
     return latency, motif_last_seen, len(used)
 
+# -----------------------------
+# Profiling hooks (opt-in)
+# -----------------------------
+class FeatureTimings:
+    """Accumulates wall time and call counts per feature function and pipeline stage.
+
+    Pass an instance to process_conversation(..., timings=t) to turn it on;
+    with timings=None the pipeline runs uninstrumented.
+    """
+
+    def __init__(self):
+        self.features = {}   # name -> [calls, total_s, max_s, max_turn]
+        self.stages = {}
+        self.turn = None     # current turn, so the slowest call can be traced back
+
+    def _add(self, table, name, dt, turn=None):
+        st = table.get(name)
+        if st is None:
+            table[name] = [1, dt, dt, turn]
+            return
+        st[0] += 1
+        st[1] += dt
+        if dt > st[2]:
+            st[2] = dt; st[3] = turn
+
+    def call(self, name, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._add(self.features, name, time.perf_counter() - t0, self.turn)
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self.stages, name, time.perf_counter() - t0)
+
+    def records(self):
+        rows = []
+        for kind, table in (("stage", self.stages), ("feature", self.features)):
+            total = sum(st[1] for st in table.values()) or 1.0
+            for name, (calls, tot, mx, mx_turn) in table.items():
+                rows.append({
+                    "kind": kind,
+                    "name": name,
+                    "calls": calls,
+                    "total_s": round(tot, 6),
+                    "mean_ms": round(tot / calls * 1000, 4),
+                    "max_ms": round(mx * 1000, 4),
+                    "max_turn": mx_turn,
+                    "share_pct": round(tot / total * 100, 2),
+                })
+        return rows
+
+    def merge(self, other):
+        """Fold in another instance's feature counts (e.g. from a worker process)."""
+        for name, (calls, tot, mx, mx_turn) in other.features.items():
+            st = self.features.setdefault(name, [0, 0.0, 0.0, None])
+            st[0] += calls
+            st[1] += tot
+            if mx > st[2]:
+                st[2] = mx; st[3] = mx_turn
+
+    def to_json(self, path, **meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, timings=self.records()), f, ensure_ascii=False, indent=2)
+
+def _call_untimed(name, fn, *args):
+    return fn(*args)
+
+def _stage(timings, name):
+    return timings.stage(name) if timings is not None else nullcontext()
+
 # -----------------------------
 # Process one conversation
 # -----------------------------
-def process_conversation(text):
-    pairs = parse_pairs(text)
-    rows = []
-    seen_glyphs = set()
-    prev_assist_q = deque(maxlen=CALLBACK_WINDOW)
-    motif_last_seen = {}
+class ConversationScorer:
+    """Online scorer: feed one (user, assistant) pair at a time.
+
+    Holds the state process_conversation() threads through its loop (seen glyphs, the
+    callback window, motif last-seen turns, the previous pair), so each add_turn() costs
+    O(turn length). A turn's proposal_uptake needs the *next* user message, so it is None
+    when returned and filled in on that same row dict by the following add_turn().
 
-    for idx, (u, a) in enumerate(pairs, start=1):
-        history_assist = " ".join(list(prev_assist_q))
+    index: optional convo_metrics_lsh.HistoryIndex; adds novelty-vs-entire-history and
+    nearest-earlier-turn columns, keyed by doc_id when the index is shared across a corpus.
+    """
+
+    def __init__(self, timings=None, index=None, doc_id=None):
+        self.seen_glyphs = set()
+        self.prev_assist_q = deque(maxlen=CALLBACK_WINDOW)
+        self.motif_last_seen = {}
+        self.prev_pair = None
+        self.last_row = None
+        self.turn = 0
+        self.timings = timings
+        self.index = index
+        self.doc_id = doc_id
+
+    @classmethod
+    def from_state(cls, state, timings=None):
+        """Resume mid-conversation from a carried_state() snapshot (no history index)."""
+        scorer = cls(timings=timings)
+        scorer.turn = state["turn"]
+        scorer.seen_glyphs = set(state["seen_glyphs"])
+        scorer.motif_last_seen = dict(state["motif_last_seen"])
+        scorer.prev_assist_q.extend(state["prev_assist"])
+        scorer.prev_pair = state["prev_pair"]
+        return scorer
+
+    def add_turn(self, user, assistant):
+        """Score the next pair and return its row dict (same columns as the metrics sheet)."""
+        timings = self.timings
+        call = timings.call if timings is not None else _call_untimed
+        u, a = user, assistant
+        self.turn += 1
+        idx = self.turn
+        if timings is not None:
+            timings.turn = idx
+
+        history_assist = " ".join(list(self.prev_assist_q))
         history_all = ""
-        if idx >= 2:
-            history_all += (pairs[idx-2][0] + " " + pairs[idx-2][1])
+        if self.prev_pair is not None:
+            history_all += (self.prev_pair[0] + " " + self.prev_pair[1])
         history_all += " " + history_assist
 
-        IA = initiative_agency(a)
-        ST = synthesis_tension(a)
-        AC = affective_charge(a)
-        cb_ratio = callback_ratio(a, list(prev_assist_q))
-        SC = self_continuity(a, seen_glyphs, cb_ratio)
-        SN = normalized_novelty(a, u, history_all)
-        CP = coherence_penalty(a, u + " " + history_all)
-
-        new_g = new_glyphs_count(a, seen_glyphs)
-        contrast_count = count_regex(CONTRAST_MARKERS, a)
-        counterfactual_count = count_regex(COUNTERFACTUAL_MARKERS, a)
-        figurative_flags = count_regex(FIGURATIVE_PATTERNS, a)
-        imagery_hits = sum(1 for t in tokenize(a) if t in SENSE_WORDS)
-        question_rate = a.count("?") / max(1, len(re.findall(r"[.!?]+", a)))
-        proposal_rate = count_regex(PROPOSAL_PATTERNS, a) / max(1, len(re.findall(r"[.!?]+", a)))
-        myth_density = glyph_density(a)
-        redundancy_3gram = trigram_redundancy(a)
-        noun_overlap = noun_overlap_ratio(a, u + " " + history_all)
-        len_bin, len_tokens = length_bin(a)
-
-        uptake = None
-        if idx < len(pairs):
-            next_user = pairs[idx][0]
-            uptake = proposal_uptake_score(a, next_user)
-
-        latency, motif_last_seen, motif_used_count = motif_latency_updates(a, motif_last_seen, idx)
-
-        E = emergence_score(IA, ST, AC, SC, SN, CP)
-        third = third_present_score(u, a)
-
-        rows.append({
+        IA = call("IA", initiative_agency, a)
+        ST = call("ST", synthesis_tension, a)
+        AC = call("AC", affective_charge, a)
+        cb_ratio = call("callback_ratio", callback_ratio, a, list(self.prev_assist_q))
+        SC = call("SC", self_continuity, a, self.seen_glyphs, cb_ratio)
+        SN = call("SN", normalized_novelty, a, u, history_all)
+        CP = call("CP", coherence_penalty, a, u + " " + history_all)
+
+        new_g = call("new_glyphs", new_glyphs_count, a, self.seen_glyphs)
+        contrast_count = call("contrast_count", count_regex, CONTRAST_MARKERS, a)
+        counterfactual_count = call("counterfactual_count", count_regex, COUNTERFACTUAL_MARKERS, a)
+        figurative_flags = call("figurative_flags", count_regex, FIGURATIVE_PATTERNS, a)
+        imagery_hits = call("imagery_hits", lambda: sum(1 for t in tokenize(a) if t in SENSE_WORDS))
+        question_rate = call("question_rate", lambda: a.count("?") / max(1, len(re.findall(r"[.!?]+", a))))
+        proposal_rate = call("proposal_rate", lambda: count_regex(PROPOSAL_PATTERNS, a) / max(1, len(re.findall(r"[.!?]+", a))))
+        myth_density = call("myth_density", glyph_density, a)
+        redundancy_3gram = call("redundancy_3gram", trigram_redundancy, a)
+        noun_overlap = call("noun_overlap", noun_overlap_ratio, a, u + " " + history_all)
+        len_bin, len_tokens = call("length_bin", length_bin, a)
+
+        # this user message answers the previous assistant turn: back-fill its uptake
+        if self.last_row is not None:
+            self.last_row["proposal_uptake"] = call("proposal_uptake", proposal_uptake_score, self.prev_pair[1], u)
+
+        latency, self.motif_last_seen, motif_used_count = call("motif_latency", motif_latency_updates, a, self.motif_last_seen, idx)
+
+        E = call("E_score", emergence_score, IA, ST, AC, SC, SN, CP)
+        third = call("third_present_legacy", third_present_score, u, a)
+
+        row = {
             "Turn": idx,
             "User": u,
             "Assistant": a,
@@ -431,7 +691,7 @@ def process_conversation(text):
             "noun_overlap_u_plus_hist": round(noun_overlap,3),
 
             # skeptical markers
-            "proposal_uptake": uptake,
+            "proposal_uptake": None,  # back-filled by the next add_turn()
             "motif_latency_min_turns": latency,
             "motif_count_used": motif_used_count,
 
@@ -443,21 +703,121 @@ def process_conversation(text):
             # human ratings — left blank for later manual input
             "Human_Presence_1to5": None,
             "Human_Coherence_1to5": None
-        })
+        }
+
+        if self.index is not None:
+            hist = call("minhash_index", self.index.observe, self.doc_id, idx, a)
+            human = {k: row.pop(k) for k in ("Human_Presence_1to5", "Human_Coherence_1to5")}
+            row.update(hist); row.update(human)
+
+        self.prev_assist_q.append(a)
+        self.prev_pair = (u, a)
+        self.last_row = row
+        return row
 
-        prev_assist_q.append(a)
+def score_pairs(pairs, timings=None, index=None, doc_id=None, turn_workers=0):
+    """Score a list of (user, assistant) pairs; returns one plain dict per turn.
 
-    df = pd.DataFrame(rows)
+    turn_workers > 1 splits long conversations (PARALLEL_MIN_TURNS+) across processes;
+    the history index is sequential by nature, so it always runs in-process.
+    """
+    if turn_workers > 1 and index is None and len(pairs) >= PARALLEL_MIN_TURNS:
+        return score_pairs_parallel(pairs, turn_workers, timings=timings)
+    scorer = ConversationScorer(timings=timings, index=index, doc_id=doc_id)
+    with _stage(timings, "features"):
+        rows = [scorer.add_turn(u, a) for u, a in pairs]
+    if timings is not None:
+        timings.turn = None
+    return rows
+
+def process_conversation(text, timings=None, index=None, doc_id=None, turn_workers=0):
+    import pandas as pd
+    with _stage(timings, "parse_pairs"):
+        pairs = parse_pairs(text)
+    df = pd.DataFrame(score_pairs(pairs, timings=timings, index=index, doc_id=doc_id,
+                                  turn_workers=turn_workers))
     return df
 
+# -----------------------------
+# Parallel scoring within one conversation
+# -----------------------------
+PARALLEL_MIN_TURNS = 2000  # shorter conversations are not worth a process pool
+MIN_CHUNK_TURNS    = 250   # smallest slice handed to a worker
+
+_EMOJI_RE = re.compile("[" + "".join(f"{re.escape(chr(lo))}-{re.escape(chr(hi))}" for lo, hi in EMOJI_RANGES) + "]")
+
+def carried_state(pairs, starts):
+    """Sequential prefix pass: ConversationScorer's carried state just before each turn index in `starts`.
+
+    Only tracks what crosses turns (glyphs seen, motif last-seen turns, the callback window,
+    the previous pair), which is far cheaper than scoring: one regex scan and a few
+    substring checks per assistant message.
+    """
+    seen, last_seen, out = set(), {}, []
+    myth_low = [(m, m.lower()) for m in MYTH_TOKENS]
+    wanted = iter(sorted(starts))
+    nxt = next(wanted, None)
+    for i in range(len(pairs) + 1):
+        while nxt == i:
+            out.append({"turn": i, "seen_glyphs": set(seen), "motif_last_seen": dict(last_seen),
+                        "prev_assist": [p[1] for p in pairs[max(0, i - CALLBACK_WINDOW):i]],
+                        "prev_pair": tuple(pairs[i - 1]) if i else None})
+            nxt = next(wanted, None)
+        if nxt is None or i == len(pairs):
+            break
+        a = pairs[i][1]
+        seen.update(_EMOJI_RE.findall(a))                       # as new_glyphs_count()
+        seen.update(m for m in MYTH_TOKENS if m in a)
+        a_low = a.lower()
+        for m, m_low in myth_low:                               # as motif_latency_updates()
+            if m_low in a_low:
+                last_seen[m] = i + 1
+    return out
+
+def _score_chunk(chunk, state, profile):
+    timings = FeatureTimings() if profile else None
+    scorer = ConversationScorer.from_state(state, timings=timings)
+    return [scorer.add_turn(u, a) for u, a in chunk], timings
+
+def score_pairs_parallel(pairs, workers, timings=None, chunk_turns=None):
+    """score_pairs() across `workers` processes: same rows, in the same order.
+
+    Each chunk is scored from the state carried_state() computed for its first turn; the only
+    cross-chunk value left is the last row's proposal_uptake, which needs the next chunk's
+    first user message and is filled in here.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    n = len(pairs)
+    size = chunk_turns or max(MIN_CHUNK_TURNS, -(-n // (workers * 4)))   # ~4 chunks per worker
+    starts = list(range(0, n, size))
+    with _stage(timings, "carried_state"):
+        states = carried_state(pairs, starts)
+    rows = []
+    with _stage(timings, "features"):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futs = [pool.submit(_score_chunk, pairs[s:s + size], st, timings is not None)
+                    for s, st in zip(starts, states)]
+            for fut in futs:
+                chunk_rows, chunk_timings = fut.result()
+                if rows:
+                    k = len(rows)
+                    rows[-1]["proposal_uptake"] = proposal_uptake_score(pairs[k - 1][1], pairs[k][0])
+                rows.extend(chunk_rows)
+                if timings is not None:
+                    timings.merge(chunk_timings)
+    return rows
+
 # -----------------------------
 # Negative-control (prompt shuffle)
 # -----------------------------
-def negative_control_prompt_shuffle(df: pd.DataFrame):
+def negative_control_prompt_shuffle(df: "pd.DataFrame", components=False):
     """Recompute E using shuffled user prompts to break coherence.
        IA, ST, AC, SC stay the same; recompute SN and CP against wrong prompts.
        Deterministic rotation avoids self-pairing.
+       components=True returns a DataFrame that also keeps the control SN/CP
+       (SN_prompt_shuffle, CP_prompt_shuffle) so weight sweeps can reuse them.
     """
+    import pandas as pd
     random.seed(RANDOM_SEED)
     n = len(df)
     if n == 0:
@@ -466,7 +826,7 @@ def negative_control_prompt_shuffle(df: pd.DataFrame):
     shift = 5 % n
     perm = idxs[shift:] + idxs[:shift]
 
-    E_ctrl = []
+    E_ctrl, SN_ctrl, CP_ctrl = [], [], []
     for i, j in zip(idxs, perm):
         a_text = df.loc[i, "Assistant"]
         wrong_user = df.loc[j, "User"]
@@ -478,89 +838,412 @@ def negative_control_prompt_shuffle(df: pd.DataFrame):
         SC = df.loc[i, "SC_self_continuity"]
         E_c = emergence_score(IA, ST, AC, SC, SNc, CPc)
         E_ctrl.append(E_c)
+        SN_ctrl.append(round(SNc,3)); CP_ctrl.append(round(CPc,3))
 
+    if components:
+        return pd.DataFrame({"E_score_prompt_shuffle": E_ctrl,
+                             "SN_prompt_shuffle": SN_ctrl,
+                             "CP_prompt_shuffle": CP_ctrl})
     return pd.Series(E_ctrl, name="E_score_prompt_shuffle")
 
-# -----------------------------
-# Batch driver
-# -----------------------------
-def main():
-    for fname in os.listdir(INPUT_FOLDER):
-        if not fname.lower().endswith(".txt"):
-            continue
-        path = os.path.join(INPUT_FOLDER, fname)
-        with open(path, "r", encoding="utf-8") as f:
-            text = f.read()
-
-        df = process_conversation(text)
-
-        # Negative-control column
-        ctrl_series = negative_control_prompt_shuffle(df)
-        if ctrl_series is not None:
-            df = pd.concat([df, ctrl_series], axis=1)
-
-        # --- Optional summaries for QC (extra sheets) ---
-        summary = {
-            "rows": [len(df)],
-            "E_mean": [round(df["E_score"].mean(),3)],
-            "E_median": [round(df["E_score"].median(),3)],
-            "E_min": [round(df["E_score"].min(),3)],
-            "E_max": [round(df["E_score"].max(),3)],
-            f"hot_share_E≥{HOT_THRESHOLD:.2f}": [round((df["E_score"]>=HOT_THRESHOLD).mean(),3)],
-            "third_mean": [round(df["third_present_legacy"].mean(),3)],
-            "third_median": [round(df["third_present_legacy"].median(),3)],
-            "third_min": [round(df["third_present_legacy"].min(),3)],
-            "third_max": [round(df["third_present_legacy"].max(),3)],
-        }
-        q = df["E_score"].quantile([0.25,0.5,0.75]).round(3)
-        summary["E_Q1"] = [q.loc[0.25]]; summary["E_Q2"] = [q.loc[0.5]]; summary["E_Q3"] = [q.loc[0.75]]
-
-        bin_summary = (
-            df.groupby("Assistant_len_bin")["E_score"]
-              .agg(['count','mean','median','min','max'])
-              .round(3).reset_index()
-        )
+def _round3_like_numpy(x):
+    # negative_control_prompt_shuffle() rounds numpy floats (rint(x*1000)/1000), which can
+    # differ from round(x, 3) on exact halves; mirror it so both paths agree bit-for-bit.
+    return round(x * 1000) / 1000
 
-        even = df[df["Turn"]%2==0]["E_score"]; odd = df[df["Turn"]%2==1]["E_score"]
-        exp_checks = {
-            "even_count": [len(even)], "even_E_mean": [round(even.mean() if len(even) else float('nan'),3)],
-            "odd_count": [len(odd)],   "odd_E_mean":  [round(odd.mean() if len(odd) else float('nan'),3)],
-            "hot_share_even": [round((even>=HOT_THRESHOLD).mean() if len(even) else float('nan'),3)],
-            "hot_share_odd":  [round((odd>=HOT_THRESHOLD).mean()  if len(odd) else float('nan'),3)],
-        }
+def prompt_shuffle_scores(rows):
+    """Same control as negative_control_prompt_shuffle(), over score_pairs() row dicts.
+       Returns a list of E_score_prompt_shuffle values (empty for no rows).
+    """
+    n = len(rows)
+    if n == 0:
+        return []
+    idxs = list(range(n))
+    shift = 5 % n
+    perm = idxs[shift:] + idxs[:shift]
 
-        if "E_score_prompt_shuffle" in df.columns:
-            ctrl = df["E_score_prompt_shuffle"]
-            exp_checks.update({
-                "ctrl_prompt_shuffle_mean": [round(ctrl.mean(),3)],
-                "ctrl_prompt_shuffle_hot_share": [round((ctrl>=HOT_THRESHOLD).mean(),3)],
-                "delta_mean_E_minus_ctrl": [round(df["E_score"].mean() - ctrl.mean(),3)]
-            })
+    E_ctrl = []
+    for i, j in zip(idxs, perm):
+        a_text = rows[i]["Assistant"]
+        wrong_user = rows[j]["User"]
+        SNc = normalized_novelty(a_text, wrong_user, "")
+        CPc = coherence_penalty(a_text, wrong_user)
+        r = rows[i]
+        wIA, wST, wAC, wSC, wSN = E_WEIGHTS
+        raw = (wIA*r["IA_initiative"] + wST*r["ST_synthesis"] + wAC*r["AC_affect"]
+               + wSC*r["SC_self_continuity"] + wSN*SNc - CPc)
+        E_ctrl.append(max(0.0, _round3_like_numpy(raw)))
+    return E_ctrl
 
-        summary_df    = pd.DataFrame(summary)
-        exp_checks_df = pd.DataFrame(exp_checks)
-        topN = df.sort_values("E_score", ascending=False).head(10).copy()
+# -----------------------------
+# QC summaries (extra sheets)
+# -----------------------------
+def build_summaries(df):
+    """Return (summary_df, bin_summary, exp_checks_df, topN) for one scored conversation."""
+    import pandas as pd
+    summary = {
+        "rows": [len(df)],
+        "E_mean": [round(df["E_score"].mean(),3)],
+        "E_median": [round(df["E_score"].median(),3)],
+        "E_min": [round(df["E_score"].min(),3)],
+        "E_max": [round(df["E_score"].max(),3)],
+        f"hot_share_E≥{HOT_THRESHOLD:.2f}": [round((df["E_score"]>=HOT_THRESHOLD).mean(),3)],
+        "third_mean": [round(df["third_present_legacy"].mean(),3)],
+        "third_median": [round(df["third_present_legacy"].median(),3)],
+        "third_min": [round(df["third_present_legacy"].min(),3)],
+        "third_max": [round(df["third_present_legacy"].max(),3)],
+    }
+    q = df["E_score"].quantile([0.25,0.5,0.75]).round(3)
+    summary["E_Q1"] = [q.loc[0.25]]; summary["E_Q2"] = [q.loc[0.5]]; summary["E_Q3"] = [q.loc[0.75]]
+
+    bin_summary = (
+        df.groupby("Assistant_len_bin")["E_score"]
+          .agg(['count','mean','median','min','max'])
+          .round(3).reset_index()
+    )
+
+    even = df[df["Turn"]%2==0]["E_score"]; odd = df[df["Turn"]%2==1]["E_score"]
+    exp_checks = {
+        "even_count": [len(even)], "even_E_mean": [round(even.mean() if len(even) else float('nan'),3)],
+        "odd_count": [len(odd)],   "odd_E_mean":  [round(odd.mean() if len(odd) else float('nan'),3)],
+        "hot_share_even": [round((even>=HOT_THRESHOLD).mean() if len(even) else float('nan'),3)],
+        "hot_share_odd":  [round((odd>=HOT_THRESHOLD).mean()  if len(odd) else float('nan'),3)],
+    }
+
+    if "E_score_prompt_shuffle" in df.columns:
+        ctrl = df["E_score_prompt_shuffle"]
+        exp_checks.update({
+            "ctrl_prompt_shuffle_mean": [round(ctrl.mean(),3)],
+            "ctrl_prompt_shuffle_hot_share": [round((ctrl>=HOT_THRESHOLD).mean(),3)],
+            "delta_mean_E_minus_ctrl": [round(df["E_score"].mean() - ctrl.mean(),3)]
+        })
 
-        base = os.path.splitext(fname)[0]
-        out_xlsx = os.path.join(OUTPUT_FOLDER, f"{base}_results.xlsx")
+    summary_df    = pd.DataFrame(summary)
+    exp_checks_df = pd.DataFrame(exp_checks)
+    topN = df.sort_values("E_score", ascending=False).head(10).copy()
+    return summary_df, bin_summary, exp_checks_df, topN
 
-        try:
+# -----------------------------
+# Per-file pipeline (score -> write)
+# -----------------------------
+SUPPORTED_EXTS = (".txt", ".docx", ".json")
+CORPUS_SUMMARY = "corpus_summary.csv"
+
+def read_file(path, profile=False):
+    """Reader stage: load one transcript (and start its timings when profiling)."""
+    timings = FeatureTimings() if profile else None
+    t_file = time.perf_counter()
+    with _stage(timings, "read"):
+        text = read_convo_from_path(path)
+    return {"fname": os.path.basename(path), "text": text, "timings": timings, "t_file": t_file}
+
+def score_loaded(item, index=None, turn_workers=0):
+    """Scoring stage: turn a read_file() item into the dict the writer stage consumes."""
+    import pandas as pd
+    fname, timings = item["fname"], item["timings"]
+    df = process_conversation(item["text"], timings=timings, index=index, doc_id=fname,
+                              turn_workers=turn_workers)
+
+    # Negative-control column
+    with _stage(timings, "prompt_shuffle"):
+        ctrl_series = negative_control_prompt_shuffle(df, components=True)
+    if ctrl_series is not None:
+        df = pd.concat([df, ctrl_series], axis=1)
+
+    with _stage(timings, "summaries"):
+        sheets = build_summaries(df) if len(df) else None
+
+    return {"fname": fname, "df": df, "sheets": sheets, "timings": timings, "t_file": item["t_file"]}
+
+def score_file(path, profile=False, index=None):
+    """Read and score one transcript file. Returns a dict the writer stage consumes."""
+    return score_loaded(read_file(path, profile), index)
+
+def write_results(result, out_folder=OUTPUT_FOLDER):
+    """Write one scored file's workbook (CSV fallback); returns its corpus-summary row."""
+    import pandas as pd
+    fname, df, timings = result["fname"], result["df"], result["timings"]
+    base = os.path.splitext(fname)[0]
+    out_xlsx = os.path.join(out_folder, f"{base}_results.xlsx")
+    if result["sheets"] is None:
+        print(f"[WARN] No User/Assistant turns found in {fname}; nothing written.")
+        return corpus_summary_row(fname, df, None)
+    summary_df, bin_summary, exp_checks_df, topN = result["sheets"]
+
+    try:
+        with _stage(timings, "write"):
             with pd.ExcelWriter(out_xlsx, engine="openpyxl") as writer:
                 df.to_excel(writer, index=False, sheet_name="metrics")
                 summary_df.to_excel(writer, index=False, sheet_name="summary")
                 bin_summary.to_excel(writer, index=False, sheet_name="bin_summary")
                 exp_checks_df.to_excel(writer, index=False, sheet_name="exp_checks")
                 topN.to_excel(writer, index=False, sheet_name="top_emergent")
+                if timings is not None:   # still inside "write", so only the JSON below has that stage
+                    pd.DataFrame(timings.records()).to_excel(writer, index=False, sheet_name="timings")
+    except Exception as e:
+        # CSV fallback if Excel write fails
+        df.to_csv(os.path.join(out_folder, f"{base}_metrics.csv"), index=False)
+        summary_df.to_csv(os.path.join(out_folder, f"{base}_summary.csv"), index=False)
+        bin_summary.to_csv(os.path.join(out_folder, f"{base}_bin_summary.csv"), index=False)
+        exp_checks_df.to_csv(os.path.join(out_folder, f"{base}_exp_checks.csv"), index=False)
+        topN.to_csv(os.path.join(out_folder, f"{base}_top_emergent.csv"), index=False)
+        if timings is not None:
+            pd.DataFrame(timings.records()).to_csv(os.path.join(out_folder, f"{base}_timings.csv"), index=False)
+        print(f"[WARN] Excel write failed for {fname} ({e}). Wrote CSVs instead.")
+
+    if timings is not None:
+        timings.to_json(os.path.join(out_folder, f"{base}_timings.json"),
+                        file=fname, turns=len(df), wall_s=round(time.perf_counter() - result["t_file"], 6))
+
+    print(f"Analyzed {fname} -> {os.path.basename(out_xlsx)}")
+    return corpus_summary_row(fname, df, out_xlsx)
+
+def analyze_file(path, out_folder=OUTPUT_FOLDER, profile=False, index=None):
+    """score_file + write_results; top-level so worker processes can run it."""
+    return write_results(score_file(path, profile=profile, index=index), out_folder)
+
+# -----------------------------
+# Pipelined read -> score -> write
+# -----------------------------
+WRITERS     = 2  # background workbook writers
+MAX_PENDING = 4  # scored files allowed to wait for a writer (and files read ahead) before we block
+
+def run_pipeline(paths, read, score, write, writers=WRITERS, max_pending=MAX_PENDING, processes=False):
+    """Overlap reading, scoring and workbook serialization across files.
+
+    A reader thread runs read(path) ahead of the caller; score(path, item) runs in the calling
+    thread; write(result) runs in a pool of `writers` threads (or processes — openpyxl is pure
+    Python, so processes give real overlap with scoring). At most `max_pending` items wait in
+    each queue, which bounds memory. Yields (path, stage, output, error) per file as it finishes,
+    where stage is the step that failed ("read"/"score"/"write") or "done".
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+    read_q = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()   # set when the caller stops iterating early, so the reader exits
+
+    def put(msg):
+        while not stop.is_set():
+            try:
+                read_q.put(msg, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        for path in paths:
+            try:
+                msg = (path, read(path), None)
+            except Exception as e:
+                msg = (path, None, e)
+            if not put(msg):
+                return
+        put(None)
+
+    reader_thread = threading.Thread(target=reader, name="pipeline-reader", daemon=True)
+    reader_thread.start()
+    Pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    inflight = {}
+
+    def finished(fut):
+        path = inflight.pop(fut)
+        err = fut.exception()
+        return (path, "write", None, err) if err else (path, "done", fut.result(), None)
+
+    try:
+        with Pool(max_workers=writers) as pool:
+            while True:
+                got = read_q.get()
+                if got is None:
+                    break
+                path, item, err = got
+                if err is not None:
+                    yield path, "read", None, err
+                    continue
+                try:
+                    result = score(path, item)
+                except Exception as e:
+                    yield path, "score", None, e
+                    continue
+                del item
+                # backpressure: wait for a writer to free up before scoring further ahead
+                while len(inflight) >= max_pending:
+                    done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield finished(fut)
+                inflight[pool.submit(write, result)] = path
+                for fut in [f for f in inflight if f.done()]:
+                    yield finished(fut)
+            while inflight:
+                done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield finished(fut)
+    finally:
+        # caller broke out (or an error escaped): release the reader and whatever it read ahead
+        stop.set()
+        while True:
+            try:
+                read_q.get_nowait()
+            except queue.Empty:
+                break
+        reader_thread.join(timeout=1.0)
+
+def run_sequential(paths, read, score, write):
+    """run_pipeline's contract without the overlap: each file is read, scored and written in turn."""
+    for path in paths:
+        stage = "read"
+        try:
+            item = read(path)
+            stage = "score"
+            result = score(path, item)
+            stage = "write"
+            yield path, "done", write(result), None
         except Exception as e:
-            # CSV fallback if Excel write fails
-            df.to_csv(os.path.join(OUTPUT_FOLDER, f"{base}_metrics.csv"), index=False)
-            summary_df.to_csv(os.path.join(OUTPUT_FOLDER, f"{base}_summary.csv"), index=False)
-            bin_summary.to_csv(os.path.join(OUTPUT_FOLDER, f"{base}_bin_summary.csv"), index=False)
-            exp_checks_df.to_csv(os.path.join(OUTPUT_FOLDER, f"{base}_exp_checks.csv"), index=False)
-            topN.to_csv(os.path.join(OUTPUT_FOLDER, f"{base}_top_emergent.csv"), index=False)
-            print(f"[WARN] Excel write failed for {fname} ({e}). Wrote CSVs instead.")
+            yield path, stage, None, e
+
+# -----------------------------
+# Corpus-level summary (one row per file)
+# -----------------------------
+CORPUS_SUMMARY_FIELDS = ["file", "turns", "E_mean", "E_median", "E_max", "hot_share",
+                         "ctrl_mean", "delta_mean_E_minus_ctrl", "third_mean", "output", "scored_at"]
+
+def corpus_summary_row(fname, df, out_path):
+    row = dict.fromkeys(CORPUS_SUMMARY_FIELDS)
+    row.update(file=fname, turns=len(df), output=os.path.basename(out_path) if out_path else None,
+               scored_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    if len(df):
+        E = df["E_score"]
+        row.update(E_mean=round(float(E.mean()),3), E_median=round(float(E.median()),3),
+                   E_max=round(float(E.max()),3), hot_share=round(float((E>=HOT_THRESHOLD).mean()),3),
+                   third_mean=round(float(df["third_present_legacy"].mean()),3))
+        if "E_score_prompt_shuffle" in df.columns:
+            ctrl = df["E_score_prompt_shuffle"]
+            row.update(ctrl_mean=round(float(ctrl.mean()),3),
+                       delta_mean_E_minus_ctrl=round(float(E.mean() - ctrl.mean()),3))
+    return row
+
+def write_corpus_summary(rows, out_folder=OUTPUT_FOLDER):
+    """(Re)write corpus_summary.csv from row dicts, atomically so readers never see half a file."""
+    import csv
+    path = os.path.join(out_folder, CORPUS_SUMMARY)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=CORPUS_SUMMARY_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        for row in sorted(rows, key=lambda r: r["file"]):
+            w.writerow(row)
+    os.replace(tmp, path)
+    return path
 
-        print(f"Analyzed {fname} -> {os.path.basename(out_xlsx)}")
+# -----------------------------
+# Config fingerprint
+# -----------------------------
+def config_version(**options):
+    """Short hash of everything that changes scores, so shards/runs scored differently never get mixed."""
+    cfg = {
+        "E_WEIGHTS": E_WEIGHTS, "HOT_THRESHOLD": HOT_THRESHOLD, "CALLBACK_WINDOW": CALLBACK_WINDOW,
+        "RANDOM_SEED": RANDOM_SEED, "LEN": [LEN_SHORT_MAX, LEN_MED_MAX],
+        "STOPWORDS": sorted(STOPWORDS), "SENSE_WORDS": sorted(SENSE_WORDS), "MYTH_TOKENS": MYTH_TOKENS,
+        "EMOJI_RANGES": EMOJI_RANGES,
+        "patterns": [CONTRAST_MARKERS, COUNTERFACTUAL_MARKERS, PROPOSAL_PATTERNS, FIGURATIVE_PATTERNS, ACCEPTANCE_PATTERNS],
+        "options": options,
+    }
+    blob = json.dumps(cfg, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:12]
+
+# -----------------------------
+# Batch driver
+# -----------------------------
+def parse_args(argv=None):
+    from convo_metrics_shard import parse_shard_spec
+    ap = argparse.ArgumentParser(description="Score conversation dumps (.txt/.docx/.json) in ./input into per-convo Excel files in ./output.")
+    ap.add_argument("--profile", action="store_true",
+                    help="time each feature/stage; adds a 'timings' sheet and writes <name>_timings.json")
+    ap.add_argument("--minhash", action="store_true",
+                    help="add novelty-vs-entire-history / nearest-earlier-turn columns (MinHash+LSH across the whole run)")
+    ap.add_argument("--watch", action="store_true",
+                    help="keep running: score new/modified files in ./input as they land (inotify, polling fallback)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="--watch: scoring processes (0 = in-process; default: CPU count)")
+    ap.add_argument("--debounce", type=float, default=2.0,
+                    help="--watch: seconds a file must stay unchanged before it is scored (default 2)")
+    ap.add_argument("--poll", type=float, default=1.0,
+                    help="--watch: polling interval in seconds when inotify is unavailable (default 1)")
+    ap.add_argument("--writers", type=int, default=WRITERS,
+                    help=f"background workbook writers, overlapping Excel output with scoring (default {WRITERS}; 0 = write inline)")
+    ap.add_argument("--writer-threads", action="store_true",
+                    help="run the writers as threads instead of processes (less startup, less overlap)")
+    ap.add_argument("--turn-workers", type=int, default=0,
+                    help=f"split conversations of {PARALLEL_MIN_TURNS}+ turns across this many processes (default 0 = off)")
+    ap.add_argument("--shard", type=parse_shard_spec, default=None, metavar="I/N",
+                    help="score only shard I of N (1-based) into output/shards/; combine later with `merge`")
+    ap.add_argument("--shard-by", choices=("name", "hash"), default="name",
+                    help="--shard: round-robin over sorted names, or by content hash (stable as files are added)")
+    args = ap.parse_args(argv)
+    if args.shard and args.minhash:
+        # each shard's index would only see its own slice, so corpus_nearest/recycled_flag would depend on N
+        ap.error("--minhash compares against the whole corpus and cannot be combined with --shard")
+    if args.shard and args.watch:
+        # watch mode scores the whole folder and writes no shard manifest
+        ap.error("--watch scores every file in the folder and cannot be combined with --shard")
+    return args
+
+def list_input_files(folder=INPUT_FOLDER):
+    # sorted: "earlier" turns in the corpus index are reproducible
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(SUPPORTED_EXTS)]
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["merge"]:
+        from convo_metrics_shard import merge_main
+        return merge_main(argv[1:])
+    args = parse_args(argv)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    index = None
+    if args.minhash:
+        from convo_metrics_lsh import HistoryIndex
+        index = HistoryIndex()
+
+    if args.watch:
+        from convo_metrics_watch import watch
+        watch(INPUT_FOLDER, OUTPUT_FOLDER, workers=args.workers, debounce=args.debounce,
+              poll=args.poll, profile=args.profile, index=index)
+        return
+
+    paths = list_input_files(INPUT_FOLDER)
+    shard = None
+    if args.shard:
+        from convo_metrics_shard import ShardRun
+        shard = ShardRun(args.shard, args.shard_by, OUTPUT_FOLDER,
+                         config_version(minhash=args.minhash))
+        paths = shard.select(paths)
+
+    def score(path, item):
+        t0 = time.perf_counter()
+        result = score_loaded(item, index, turn_workers=args.turn_workers)
+        if shard is not None:
+            shard.add_rows(path, result["df"], time.perf_counter() - t0)
+        return result
+
+    read = functools.partial(read_file, profile=args.profile)
+    write = functools.partial(write_results, out_folder=OUTPUT_FOLDER)
+    if args.writers <= 0:
+        stages = run_sequential(paths, read, score, write)
+    else:
+        stages = run_pipeline(paths, read, score, write, writers=args.writers,
+                              processes=not args.writer_threads)
+    rows = []
+    for path, stage, row, err in stages:
+        if shard is not None:
+            shard.record(path, stage, err)
+        if err is not None:
+            print(f"[WARN] Skipped {os.path.basename(path)} ({stage} failed): {err}")
+        else:
+            rows.append(row)
+    if shard is not None:
+        shard.finish(rows)   # the merge step writes the corpus-wide summary
+    else:
+        write_corpus_summary(rows, OUTPUT_FOLDER)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,373 @@
+# convo_metrics_equivalence.py — golden-output differential harness
+# Runs the reference process_conversation() and an alternative scoring engine over the same
+# corpus (real .txt files or a deterministic synthetic one) and reports per-column mismatches.
+# Any optimized path must pass this before it is allowed near the longitudinal data.
+#
+#   python convo_metrics_equivalence.py --engine mymodule:score_text --input input
+#   python convo_metrics_equivalence.py --engine mymodule:score_text --synthetic 200 --tol 0.001
+#   python convo_metrics_equivalence.py --save-golden golden --input input   # freeze today's reference
+#   python convo_metrics_equivalence.py --engine online --golden golden --input input
+#   python convo_metrics_equivalence.py --docx-check --input input   # streaming .docx reader vs python-docx
+#
+# Without --golden the reference is recomputed from the current process_conversation(), so a
+# change to code both engines share goes unnoticed; --golden diffs against a saved snapshot instead.
+# An engine is any callable text -> DataFrame or list of row dicts, with the same column names
+# as process_conversation(). Exit code is 1 when anything mismatches.
+
+import os, sys, json, math, time, random, hashlib, argparse, importlib
+
+import convo_metrics_batch_v4 as core
+
+# Columns that feed longitudinal comparisons — compared by default.
+DEFAULT_COLUMNS = [
+    "Turn", "Assistant_len_tokens", "Assistant_len_bin",
+    "IA_initiative", "ST_synthesis", "AC_affect", "SC_self_continuity", "SN_norm_novelty", "CP_coherence_penalty",
+    "proposal_rate", "question_rate", "contrast_count", "counterfactual_count", "imagery_hits",
+    "figurative_flags", "myth_density", "new_glyphs", "callback_ratio", "redundancy_3gram",
+    "noun_overlap_u_plus_hist", "proposal_uptake", "motif_latency_min_turns", "motif_count_used",
+    "E_score", "Top_E_flag", "third_present_legacy", "E_score_prompt_shuffle",
+]
+
+# -----------------------------
+# Engines
+# -----------------------------
+def reference_engine(text):
+    """The reference path: process_conversation + prompt-shuffle control, exactly as main() runs it."""
+    import pandas as pd
+    df = core.process_conversation(text)
+    ctrl = core.negative_control_prompt_shuffle(df)
+    if ctrl is not None:
+        df = pd.concat([df, ctrl], axis=1)
+    return df
+
+def online_engine(text):
+    """ConversationScorer fed one pair at a time, as the live dashboards use it."""
+    scorer = core.ConversationScorer()
+    rows = [scorer.add_turn(u, a) for u, a in core.parse_pairs(text)]
+    for r, e in zip(rows, core.prompt_shuffle_scores(rows)):
+        r["E_score_prompt_shuffle"] = e
+    return rows
+
+def parallel_engine(text):
+    """score_pairs_parallel with deliberately tiny chunks, so every chunk boundary gets exercised."""
+    rows = core.score_pairs_parallel(core.parse_pairs(text), workers=2, chunk_turns=7)
+    for r, e in zip(rows, core.prompt_shuffle_scores(rows)):
+        r["E_score_prompt_shuffle"] = e
+    return rows
+
+ENGINES = {
+    "reference": reference_engine,
+    "online": online_engine,
+    "parallel": parallel_engine,
+}
+
+def load_engine(spec):
+    """'name' from ENGINES, or 'module:function' importable from the current path."""
+    if spec in ENGINES:
+        return ENGINES[spec]
+    if ":" not in spec:
+        raise ValueError(f"Unknown engine {spec!r}. Use one of {sorted(ENGINES)} or module:function.")
+    mod_name, fn_name = spec.split(":", 1)
+    return getattr(importlib.import_module(mod_name), fn_name)
+
+def _as_records(out):
+    if out is None:
+        return []
+    if hasattr(out, "to_dict"):
+        return out.to_dict("records")
+    return list(out)
+
+# -----------------------------
+# Corpora
+# -----------------------------
+def corpus_from_folder(folder):
+    """Yield (name, text) for every file the batch script would score, in the same order."""
+    for path in core.list_input_files(folder):
+        yield os.path.basename(path), core.read_convo_from_path(path)
+
+_FILLER = ("river stone model plan data code answer thread window memory question signal field "
+           "story voice pattern system choice path map room door").split()
+
+def _synthetic_text(rng, n_turns):
+    vocab = (_FILLER + sorted(core.SENSE_WORDS) + core.MYTH_TOKENS +
+             ["but", "however", "what if", "maybe", "let's", "consider", "imagine", "as if", "like a",
+              "both", "and", "neither", "nor", "okay", "sure", "🌀", "🔥", "✨"])
+    headers = [("User:", "Assistant:"), ("You said:", "ChatGPT said:"), ("**User:**", "**Claude:**"),
+               ("Human:", "Assistant:")]
+    u_h, a_h = rng.choice(headers)
+
+    def block(n_sents, max_words):
+        sents = []
+        for _ in range(n_sents):
+            words = [rng.choice(vocab) for _ in range(rng.randint(2, max_words))]
+            sents.append(" ".join(words) + rng.choice([".", ".", "?", "!", "..."]))
+        return " ".join(sents)
+
+    lines = []
+    for _ in range(n_turns):
+        lines.append(f"{u_h} {block(rng.randint(1, 3), 12)}")
+        # occasionally a very long assistant turn, to exercise length bins and the DOTALL regexes
+        n_sents = rng.randint(1, 8) if rng.random() > 0.05 else rng.randint(60, 120)
+        lines.append(f"{a_h} {block(n_sents, 25)}")
+    return "\n".join(lines)
+
+def synthetic_corpus(n_convos, seed=core.RANDOM_SEED, min_turns=1, max_turns=40):
+    """Yield (name, text) for a deterministic synthetic corpus built from the scoring lexicons."""
+    rng = random.Random(seed)
+    for i in range(n_convos):
+        yield f"synthetic_{i:04d}", _synthetic_text(rng, rng.randint(min_turns, max_turns))
+
+# -----------------------------
+# Golden snapshots
+# -----------------------------
+GOLDEN_MANIFEST = "golden.json"
+
+def _text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _json_default(o):
+    return o.item() if hasattr(o, "item") else str(o)   # numpy scalars from DataFrame rows
+
+def save_golden(corpus, folder, reference=reference_engine):
+    """Score every (name, text) with `reference` and freeze the rows, one JSON file per transcript."""
+    os.makedirs(folder, exist_ok=True)
+    version, files = core.config_version(), []
+    for i, (name, text) in enumerate(corpus):
+        fname = f"{i:05d}_{os.path.splitext(name)[0]}.json"
+        with open(os.path.join(folder, fname), "w", encoding="utf-8") as f:
+            json.dump({"file": name, "sha256": _text_sha256(text), "config_version": version,
+                       "rows": _as_records(reference(text))}, f, ensure_ascii=False, default=_json_default)
+        files.append(fname)
+    with open(os.path.join(folder, GOLDEN_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"config_version": version, "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "files": files}, f, ensure_ascii=False, indent=2)
+    return files
+
+class GoldenReference:
+    """A reference engine that looks transcripts up (by content hash) in a save_golden() snapshot."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, GOLDEN_MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.config_version = manifest["config_version"]
+        self.rows = {}
+        for fname in manifest["files"]:
+            with open(os.path.join(folder, fname), "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            self.rows[snap["sha256"]] = snap["rows"]
+        if self.config_version != core.config_version():
+            print(f"[WARN] Golden snapshot was taken with config {self.config_version}, current config is "
+                  f"{core.config_version()}; score changes from the config will show up as mismatches.")
+
+    def __call__(self, text):
+        try:
+            return self.rows[_text_sha256(text)]
+        except KeyError:
+            raise LookupError("transcript not in the golden snapshot (new or edited since --save-golden)") from None
+
+# -----------------------------
+# .docx reader vs python-docx
+# -----------------------------
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+def docx_fixture(path):
+    """Write a small .docx with the structures the streaming reader must skip or keep (needs python-docx)."""
+    from docx import Document
+    from docx.shared import Inches
+    from docx.enum.text import WD_BREAK
+    from docx.oxml import parse_xml
+
+    doc = Document()
+    p = doc.add_paragraph("User: hello")                      # custom tab stops in <w:pPr><w:tabs>
+    p.paragraph_format.tab_stops.add_tab_stop(Inches(1))
+    p.paragraph_format.tab_stops.add_tab_stop(Inches(2))
+    doc.add_paragraph().paragraph_format.tab_stops.add_tab_stop(Inches(1))   # empty, one tab stop
+    p = doc.add_paragraph("Assistant: a\tb")                 # run tab, line break, page break
+    p.add_run().add_break()
+    p.add_run("after line")
+    p.add_run().add_break(WD_BREAK.PAGE)
+    p.add_run("after page")
+    doc.add_table(rows=1, cols=2).rows[0].cells[0].text = "table cell"
+    p = doc.add_paragraph("see ")
+    p._p.append(parse_xml(f'<w:hyperlink xmlns:w="{_W}"><w:r><w:t>the link</w:t></w:r></w:hyperlink>'))
+    p = doc.add_paragraph("before box ")
+    p._p.append(parse_xml(
+        f'<w:r xmlns:w="{_W}" xmlns:v="urn:schemas-microsoft-com:vml"><w:pict><v:shape><v:textbox>'
+        f'<w:txbxContent><w:p><w:r><w:tab/><w:t>boxed</w:t></w:r></w:p></w:txbxContent>'
+        f'</v:textbox></v:shape></w:pict></w:r>'))
+    doc.add_paragraph("User: bye")
+    doc.save(path)
+    return path
+
+def check_docx_reader(paths):
+    """Compare iter_docx_paragraphs() with python-docx paragraph text; returns mismatch dicts."""
+    from docx import Document
+    out = []
+    for path in paths:
+        ref = [p.text for p in Document(path).paragraphs]
+        got = list(core.iter_docx_paragraphs(path))
+        if len(ref) != len(got):
+            out.append({"file": os.path.basename(path), "paragraph": None, "ref": len(ref), "alt": len(got)})
+        for i, (r, g) in enumerate(zip(ref, got), start=1):
+            if r != g:
+                out.append({"file": os.path.basename(path), "paragraph": i, "ref": r, "alt": g})
+    return out
+
+# -----------------------------
+# Comparison
+# -----------------------------
+def _missing(v):
+    return v is None or (isinstance(v, float) and math.isnan(v))
+
+def values_match(a, b, tol):
+    if _missing(a) or _missing(b):
+        return _missing(a) and _missing(b)
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return abs(float(a) - float(b)) <= tol
+
+def compare_records(ref_rows, alt_rows, columns, tolerances, default_tol=0.0):
+    """Return a list of mismatch dicts {turn, column, ref, alt} between two row lists."""
+    out = []
+    if len(ref_rows) != len(alt_rows):
+        out.append({"turn": None, "column": "<row_count>", "ref": len(ref_rows), "alt": len(alt_rows)})
+    for i, (r, a) in enumerate(zip(ref_rows, alt_rows), start=1):
+        for col in columns:
+            if col not in r:
+                continue
+            if col not in a:
+                out.append({"turn": i, "column": col, "ref": r[col], "alt": "<missing>"})
+                continue
+            if not values_match(r[col], a[col], tolerances.get(col, default_tol)):
+                out.append({"turn": i, "column": col, "ref": r[col], "alt": a[col]})
+    return out
+
+def run_harness(corpus, engine, reference=reference_engine, columns=DEFAULT_COLUMNS,
+                tolerances=None, default_tol=0.0, max_examples=20):
+    """Score every (name, text) with both engines and build a per-column mismatch report."""
+    tolerances = tolerances or {}
+    per_column = {c: {"compared": 0, "mismatches": 0, "max_abs_diff": 0.0} for c in columns}
+    examples, files, bad_files = [], 0, []
+
+    for name, text in corpus:
+        files += 1
+        # one bad transcript (e.g. new since the golden snapshot) must not hide the rest of the report
+        failed = None
+        try:
+            ref_rows = _as_records(reference(text))
+        except Exception as e:
+            failed = ("<missing_reference>", e)
+        else:
+            try:
+                alt_rows = _as_records(engine(text))
+            except Exception as e:
+                failed = ("<engine_error>", e)
+        if failed is not None:
+            col, err = failed
+            bad_files.append(name)
+            per_column.setdefault(col, {"compared": 0, "mismatches": 0, "max_abs_diff": 0.0})["mismatches"] += 1
+            if len(examples) < max_examples:
+                examples.append({"file": name, "turn": None, "column": col, "ref": None, "alt": f"{type(err).__name__}: {err}"})
+            continue
+        for r in ref_rows[:len(alt_rows)]:
+            for c in columns:
+                if c in r:
+                    per_column[c]["compared"] += 1
+        mism = compare_records(ref_rows, alt_rows, columns, tolerances, default_tol)
+        if mism:
+            bad_files.append(name)
+        for m in mism:
+            stats = per_column.setdefault(m["column"], {"compared": 0, "mismatches": 0, "max_abs_diff": 0.0})
+            stats["mismatches"] += 1
+            try:
+                stats["max_abs_diff"] = max(stats["max_abs_diff"], abs(float(m["ref"]) - float(m["alt"])))
+            except (TypeError, ValueError):
+                pass
+            if len(examples) < max_examples:
+                examples.append(dict(m, file=name))
+
+    return {
+        "files": files,
+        "files_with_mismatches": bad_files,
+        "columns": per_column,
+        "examples": examples,
+        "ok": not bad_files,
+    }
+
+def format_report(report):
+    lines = [f"Files compared: {report['files']}  |  files with mismatches: {len(report['files_with_mismatches'])}"]
+    lines.append(f"{'column':<28}{'compared':>10}{'mismatch':>10}{'max_abs_diff':>14}")
+    for col, st in report["columns"].items():
+        if st["compared"] or st["mismatches"]:
+            lines.append(f"{col:<28}{st['compared']:>10}{st['mismatches']:>10}{st['max_abs_diff']:>14.6g}")
+    for ex in report["examples"]:
+        lines.append(f"  {ex['file']} turn {ex['turn']}: {ex['column']} ref={ex['ref']!r} alt={ex['alt']!r}")
+    lines.append("OK — outputs equivalent." if report["ok"] else "MISMATCH — engine is not equivalent to the reference.")
+    return "\n".join(lines)
+
+# -----------------------------
+# CLI
+# -----------------------------
+def _parse_col_tol(items):
+    out = {}
+    for item in items or []:
+        col, _, val = item.partition("=")
+        out[col] = float(val)
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Differential check of a scoring engine against process_conversation().")
+    ap.add_argument("--docx-check", action="store_true",
+                    help="compare the streaming .docx reader with python-docx (a built-in fixture + any .docx in --input)")
+    ap.add_argument("--engine", default=None, help="engine name (%s) or module:function" % ", ".join(sorted(ENGINES)))
+    gold = ap.add_mutually_exclusive_group()
+    gold.add_argument("--save-golden", default=None, metavar="DIR", help="snapshot the reference rows into DIR and exit")
+    gold.add_argument("--golden", default=None, metavar="DIR", help="diff against a --save-golden snapshot, not today's code")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--input", default=None, help="folder of transcripts (.txt/.docx/.json; default: ./input)")
+    src.add_argument("--synthetic", type=int, default=None, metavar="N", help="use N synthetic conversations instead")
+    ap.add_argument("--seed", type=int, default=core.RANDOM_SEED, help="seed for the synthetic corpus")
+    ap.add_argument("--tol", type=float, default=0.0, help="absolute tolerance for numeric columns (default exact)")
+    ap.add_argument("--col-tol", action="append", metavar="COL=TOL", help="per-column tolerance override (repeatable)")
+    ap.add_argument("--columns", default=None, help="comma-separated columns to compare (default: scores + markers)")
+    ap.add_argument("--report", default=None, help="also write the full report as JSON to this path")
+    args = ap.parse_args(argv)
+    if args.docx_check:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [docx_fixture(os.path.join(tmp, "fixture.docx"))]
+            folder = args.input or core.INPUT_FOLDER
+            if os.path.isdir(folder):
+                paths += [p for p in core.list_input_files(folder) if p.lower().endswith(".docx")]
+            mism = check_docx_reader(paths)
+        for m in mism:
+            print(f"  {m['file']} paragraph {m['paragraph']}: python-docx={m['ref']!r} reader={m['alt']!r}")
+        print(f"{len(paths)} .docx file(s): " + ("OK — reader matches python-docx." if not mism else "MISMATCH."))
+        return 1 if mism else 0
+    if args.engine is None and args.save_golden is None:
+        ap.error("--engine is required (unless --save-golden or --docx-check)")
+
+    if args.synthetic is not None:
+        corpus = synthetic_corpus(args.synthetic, seed=args.seed)
+    else:
+        corpus = corpus_from_folder(args.input or core.INPUT_FOLDER)
+
+    if args.save_golden:
+        files = save_golden(corpus, args.save_golden)
+        print(f"Saved golden rows for {len(files)} transcript(s) to {args.save_golden} (config {core.config_version()}).")
+        return 0
+
+    engine = load_engine(args.engine)
+    reference = GoldenReference(args.golden) if args.golden else reference_engine
+    columns = args.columns.split(",") if args.columns else DEFAULT_COLUMNS
+
+    report = run_harness(corpus, engine, reference=reference, columns=columns,
+                         tolerances=_parse_col_tol(args.col_tol), default_tol=args.tol)
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    return 0 if report["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# convo_metrics_lsh.py — approximate "have we said this before?" index (MinHash + LSH)
+# normalized_novelty / callback_ratio only look back CALLBACK_WINDOW turns because exact set
+# comparisons against everything would be quadratic. This index keeps a MinHash signature of
+# every assistant turn it has seen (in this conversation and across the corpus) and finds the
+# most similar earlier turn through LSH buckets, in roughly constant time per turn.
+#
+# Used through ConversationScorer(index=HistoryIndex(), doc_id=...) or `--minhash` on the batch
+# script; adds these columns to each row:
+#   SN_history_novelty    1 - similarity to the closest earlier turn of the same conversation
+#   nearest_earlier_turn  that turn's number (None if nothing similar enough was found)
+#   nearest_earlier_sim   its estimated Jaccard similarity
+#   corpus_nearest        "<doc>#<turn>" of the closest turn in any *other* conversation
+#   corpus_nearest_sim    its estimated Jaccard similarity
+#   recycled_flag         1 if corpus_nearest_sim >= RECYCLED_THRESHOLD
+
+import random, zlib
+
+import convo_metrics_batch_v4 as core
+
+NUM_PERM           = 64     # signature length
+BANDS              = 16     # LSH bands (NUM_PERM / BANDS rows each -> candidate threshold ~0.5)
+MAX_BUCKET_SCAN    = 64     # most recent items looked at per bucket, keeps lookups O(1)
+RECYCLED_THRESHOLD = 0.80
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+class MinHashLSH:
+    """MinHash signatures over token sets, bucketed by band for candidate lookup."""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, seed=core.RANDOM_SEED, max_bucket_scan=MAX_BUCKET_SCAN):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_bucket_scan = max_bucket_scan
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+
+    def signature(self, tokens):
+        """Tuple of num_perm minimum hashes, or None for an empty token set."""
+        hs = [zlib.crc32(t.encode("utf-8")) for t in tokens]
+        if not hs:
+            return None
+        return tuple(min([((a * h + b) % _MERSENNE) & _MAX_HASH for h in hs]) for a, b in self.perms)
+
+    def _band_keys(self, sig):
+        r = self.rows
+        return [sig[i*r:(i+1)*r] for i in range(self.bands)]
+
+    def candidates(self, sig):
+        seen = set()
+        for band, key in zip(self.buckets, self._band_keys(sig)):
+            for item in band.get(key, ())[-self.max_bucket_scan:]:
+                seen.add(item)
+        return seen
+
+    def insert(self, sig):
+        """Store sig and return its item id."""
+        item = len(self.signatures)
+        self.signatures.append(sig)
+        for band, key in zip(self.buckets, self._band_keys(sig)):
+            band.setdefault(key, []).append(item)
+        return item
+
+    def remove(self, item):
+        """Drop an item from every bucket (its id is never reused)."""
+        sig = self.signatures[item]
+        if sig is None:
+            return
+        for band, key in zip(self.buckets, self._band_keys(sig)):
+            band[key].remove(item)
+            if not band[key]:
+                del band[key]
+        self.signatures[item] = None
+
+    @staticmethod
+    def similarity(s1, s2):
+        return sum(1 for x, y in zip(s1, s2) if x == y) / len(s1)
+
+class HistoryIndex:
+    """One MinHashLSH shared by every conversation of a run, remembering which doc/turn each item is."""
+
+    def __init__(self, recycled_threshold=RECYCLED_THRESHOLD, **lsh_kwargs):
+        self.lsh = MinHashLSH(**lsh_kwargs)
+        self.recycled_threshold = recycled_threshold
+        self.meta = []  # item id -> (doc_id, turn)
+        self.doc_items = {}  # doc_id -> item ids, so a rescored document can be forgotten first
+
+    def observe(self, doc_id, turn, assistant_text):
+        """Look up the closest earlier turns for this assistant text, then add it to the index."""
+        cols = {
+            "SN_history_novelty": 1.0,
+            "nearest_earlier_turn": None,
+            "nearest_earlier_sim": 0.0,
+            "corpus_nearest": None,
+            "corpus_nearest_sim": 0.0,
+            "recycled_flag": 0,
+        }
+        sig = self.lsh.signature(core.unique_content_words(assistant_text))
+        if sig is None:
+            return cols
+
+        best_own, best_other = (0.0, None), (0.0, None)
+        for item in sorted(self.lsh.candidates(sig)):   # ties go to the earliest turn, independent of set order
+            sim = MinHashLSH.similarity(sig, self.lsh.signatures[item])
+            if self.meta[item][0] == doc_id:
+                if sim > best_own[0]:
+                    best_own = (sim, item)
+            elif sim > best_other[0]:
+                best_other = (sim, item)
+
+        if best_own[1] is not None:
+            cols["nearest_earlier_turn"] = self.meta[best_own[1]][1]
+            cols["nearest_earlier_sim"] = round(best_own[0], 3)
+            cols["SN_history_novelty"] = round(1.0 - best_own[0], 3)
+        if best_other[1] is not None:
+            doc, t = self.meta[best_other[1]]
+            cols["corpus_nearest"] = f"{doc}#{t}"
+            cols["corpus_nearest_sim"] = round(best_other[0], 3)
+            cols["recycled_flag"] = int(best_other[0] >= self.recycled_threshold)
+
+        self.doc_items.setdefault(doc_id, []).append(self.lsh.insert(sig))
+        self.meta.append((doc_id, turn))
+        return cols
+
+    def forget(self, doc_id):
+        """Remove every turn observed for doc_id, e.g. before scoring a new version of that file."""
+        for item in self.doc_items.pop(doc_id, ()):
+            self.lsh.remove(item)
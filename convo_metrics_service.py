@@ -0,0 +1,275 @@
+# convo_metrics_service.py — long-running scoring service (stdin JSON-lines + localhost HTTP)
+# Keeps the scoring module, lexicons and compiled regexes warm so each request only pays for scoring.
+#
+#   python convo_metrics_service.py --stdin              # one JSON request per line in, one JSON reply per line out
+#   python convo_metrics_service.py --http 8765          # POST /score  (GET /health)
+#
+# Request (JSON object, or a list of them over HTTP):
+#   {"id": "...", "text": "User: ...\nAssistant: ..."}          whole transcript, parsed like the batch script
+#   {"id": "...", "pairs": [["user", "assistant"], ...]}        already-split turns
+#   {"id": "...", "user": "...", "assistant": "..."}            a single turn
+#   optional "control": true/false  -> add E_score_prompt_shuffle (default: on for 2+ turns)
+# Reply: {"id": ..., "rows": [...per-turn metrics...], "summary": {...}} or {"id": ..., "error": "..."}
+#
+# Live conversations: add "session": "<key>" to a single-turn request and the service keeps a
+# ConversationScorer for it, so history-aware features see the earlier turns. The reply is
+#   {"id": ..., "session": ..., "row": {...}, "backfill": {"Turn": n-1, "proposal_uptake": x} | null}
+# "reset": true starts the session over; "end": true drops it after scoring.
+
+import sys, json, time, queue, threading, argparse
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import convo_metrics_batch_v4 as core
+
+DEFAULT_PORT   = 8765
+BATCH_MAX      = 32     # requests scored per batch
+BATCH_WINDOW_S = 0.005  # how long the batcher waits for more requests once one has arrived
+MAX_SESSIONS   = 1000   # live conversations kept in memory (least recently used dropped first)
+
+# -----------------------------
+# Request handling
+# -----------------------------
+def _pairs_from_request(req):
+    if "text" in req:
+        return core.parse_pairs(req["text"])
+    if "pairs" in req:
+        return [(str(u), str(a)) for u, a in req["pairs"]]
+    if "user" in req and "assistant" in req:
+        return [(str(req["user"]), str(req["assistant"]))]
+    raise ValueError("request needs 'text', 'pairs', or 'user' + 'assistant'")
+
+def _summary(rows):
+    if not rows:
+        return {"turns": 0}
+    E = [r["E_score"] for r in rows]
+    return {
+        "turns": len(rows),
+        "E_mean": round(sum(E) / len(E), 3),
+        "E_max": max(E),
+        "hot_share": round(sum(e >= core.HOT_THRESHOLD for e in E) / len(E), 3),
+    }
+
+def score_request(req):
+    """Score one request dict and return the reply dict (never raises)."""
+    rid = req.get("id") if isinstance(req, dict) else None
+    try:
+        if not isinstance(req, dict):
+            raise ValueError("request must be a JSON object")
+        rows = core.score_pairs(_pairs_from_request(req))
+        if req.get("control", len(rows) > 1):
+            for r, e in zip(rows, core.prompt_shuffle_scores(rows)):
+                r["E_score_prompt_shuffle"] = e
+        return {"id": rid, "rows": rows, "summary": _summary(rows)}
+    except Exception as e:
+        return {"id": rid, "error": f"{type(e).__name__}: {e}"}
+
+def score_batch(reqs):
+    return [score_request(r) for r in reqs]
+
+def warm_up():
+    """Touch every regex and lexicon once so the first real request is not the slow one."""
+    score_request({"text": "User: let's try a warm bright spiral?\nAssistant: But what if we could, as if a glyph 🌀...\n"
+                           "User: okay\nAssistant: Both this and that; neither here nor there."})
+
+class SessionStore:
+    """ConversationScorer per live session key, least-recently-used evicted past max_sessions."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+    def score_turn(self, req):
+        rid, key = req.get("id"), req.get("session")
+        try:
+            if "user" not in req or "assistant" not in req:
+                raise ValueError("session requests need 'user' + 'assistant'")
+            scorer = None if req.get("reset") else self.sessions.get(key)
+            if scorer is None:
+                scorer = core.ConversationScorer()
+            self.sessions[key] = scorer
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+            prev = scorer.last_row
+            row = scorer.add_turn(str(req["user"]), str(req["assistant"]))
+            backfill = None
+            if prev is not None:
+                backfill = {"Turn": prev["Turn"], "proposal_uptake": prev["proposal_uptake"]}
+            if req.get("end"):
+                self.sessions.pop(key, None)
+            return {"id": rid, "session": key, "row": row, "backfill": backfill}
+        except Exception as e:
+            return {"id": rid, "session": key, "error": f"{type(e).__name__}: {e}"}
+
+# -----------------------------
+# Micro-batcher
+# -----------------------------
+class Batcher:
+    """Collects concurrent requests into small batches and scores them on one worker thread
+    (optionally fanned out to a process pool), so callers only ever wait on a Future.
+    Session turns always run on the batcher thread, in arrival order, against its SessionStore.
+    """
+
+    def __init__(self, workers=0, batch_max=BATCH_MAX, window_s=BATCH_WINDOW_S, max_sessions=MAX_SESSIONS):
+        self.q = queue.Queue()
+        self.sessions = SessionStore(max_sessions)
+        self.batch_max = batch_max
+        self.window_s = window_s
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up) if workers > 0 else None
+        self.workers = workers
+        self._thread = threading.Thread(target=self._run, name="scoring-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, req):
+        fut = Future()
+        self.q.put((req, fut))
+        return fut
+
+    def _collect(self):
+        batch = [self.q.get()]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.batch_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _score_stateless(self, reqs):
+        if self.pool is not None and len(reqs) > 1:
+            chunk = -(-len(reqs) // self.workers)
+            futs = [self.pool.submit(score_batch, reqs[i:i+chunk]) for i in range(0, len(reqs), chunk)]
+            return [rep for f in futs for rep in f.result()]
+        return score_batch(reqs)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stateless = [(req, fut) for req, fut in batch if not (isinstance(req, dict) and "session" in req)]
+            try:
+                replies = self._score_stateless([r for r, _ in stateless])
+            except Exception as e:
+                replies = [{"id": r.get("id") if isinstance(r, dict) else None,
+                            "error": f"{type(e).__name__}: {e}"} for r, _ in stateless]
+            for (_, fut), rep in zip(stateless, replies):
+                fut.set_result(rep)
+            for req, fut in batch:
+                if isinstance(req, dict) and "session" in req:
+                    fut.set_result(self.sessions.score_turn(req))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------------
+# Front ends
+# -----------------------------
+def serve_stdin(batcher, inp=sys.stdin, out=sys.stdout):
+    """JSON-lines in, JSON-lines out, replies in request order. Reading and scoring overlap."""
+    pending = queue.Queue()
+
+    def printer():
+        while True:
+            fut = pending.get()
+            if fut is None:
+                return
+            out.write(json.dumps(fut.result(), ensure_ascii=False) + "\n")
+            out.flush()
+
+    t = threading.Thread(target=printer, name="stdin-replies", daemon=True)
+    t.start()
+    for line in inp:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            req = json.loads(line)
+        except json.JSONDecodeError as e:
+            fut = Future()
+            fut.set_result({"id": None, "error": f"JSONDecodeError: {e}"})
+        else:
+            fut = batcher.submit(req)
+        pending.put(fut)
+    pending.put(None)
+    t.join()
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"ok": True})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            except Exception as e:
+                self._reply(400, {"error": f"bad request: {e}"})
+                return
+            if isinstance(payload, list):
+                futs = [batcher.submit(r) for r in payload]
+                self._reply(200, [f.result() for f in futs])
+            else:
+                self._reply(200, batcher.submit(payload).result())
+
+        def log_message(self, fmt, *args):  # keep stdout quiet; errors still go to stderr
+            pass
+
+    return Handler
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # chat-logging bursts open many connections at once
+
+def serve_http(batcher, port=DEFAULT_PORT, host="127.0.0.1"):
+    httpd = _Server((host, port), make_handler(batcher))
+    print(f"Scoring service on http://{host}:{httpd.server_address[1]}/score", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Warm E-score scoring service (stdin JSON-lines or localhost HTTP).")
+    mode = ap.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--stdin", action="store_true", help="read JSON requests from stdin, one per line")
+    mode.add_argument("--http", type=int, nargs="?", const=DEFAULT_PORT, metavar="PORT",
+                      help=f"serve POST /score on localhost (default port {DEFAULT_PORT})")
+    ap.add_argument("--workers", type=int, default=0, help="score batches in this many worker processes (default: in-process)")
+    ap.add_argument("--batch-max", type=int, default=BATCH_MAX)
+    ap.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_S * 1000)
+    args = ap.parse_args(argv)
+
+    warm_up()
+    batcher = Batcher(workers=args.workers, batch_max=args.batch_max, window_s=args.batch_window_ms / 1000)
+    try:
+        if args.stdin:
+            serve_stdin(batcher)
+        else:
+            serve_http(batcher, port=args.http)
+    finally:
+        batcher.close()
+
+if __name__ == "__main__":
+    main()
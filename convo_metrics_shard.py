@@ -0,0 +1,233 @@
+# convo_metrics_shard.py — sharded corpus runs and the merge step
+# Split a corpus over several machines, each running the batch script on its own slice:
+#
+#   python convo_metrics_batch_v4.py --shard 1/4                 # ... 2/4, 3/4, 4/4 on other boxes
+#   python convo_metrics_batch_v4.py --shard 3/4 --shard-by hash # assignment stable as files are added
+#   python convo_metrics_batch_v4.py merge --shards-dir output/shards --input input
+#
+# Each shard writes, under output/shards/:
+#   shard_<i>_of_<N>_rows.csv       every scored turn, with a source_file column (the corpus dataset slice)
+#   shard_<i>_of_<N>_summary.csv    one corpus-summary row per file
+#   shard_<i>_of_<N>_manifest.json  shard spec, config version, per-file sha256/turns/status, timings
+# `merge` checks the manifests agree (same N, same config version, every shard present, no file
+# twice, and — with --input — every input file present with the same content) before writing
+# output/corpus_dataset.csv, output/corpus_summary.csv and output/merge_report.json.
+
+import os, csv, json, time, socket, hashlib, argparse
+
+import convo_metrics_batch_v4 as core
+
+SHARDS_DIR      = "shards"
+CORPUS_DATASET  = "corpus_dataset.csv"
+MERGE_REPORT    = "merge_report.json"
+
+def parse_shard_spec(spec):
+    """'i/N' (1-based) -> (i, N)."""
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard spec must look like i/N, got {spec!r}")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"shard index must be in 1..{n}, got {i}")
+    return i, n
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def shard_of(position, digest, n, by):
+    """0-based shard for a file: round-robin over the sorted file list, or by content hash."""
+    return int(digest, 16) % n if by == "hash" else position % n
+
+def _prefix(i, n):
+    return f"shard_{i:03d}_of_{n:03d}"
+
+# -----------------------------
+# One shard's run
+# -----------------------------
+class ShardRun:
+    """Picks this shard's files and records everything the merge step needs."""
+
+    def __init__(self, spec, by, out_folder, config_version):
+        self.i, self.n = spec   # parse_shard_spec() output
+        self.by = by
+        self.dir = os.path.join(out_folder, SHARDS_DIR)
+        self.config_version = config_version
+        self.files = {}        # name -> manifest entry
+        self.t0 = time.perf_counter()
+        self._rows_f = None
+        self._rows_w = None
+        os.makedirs(self.dir, exist_ok=True)
+        self.prefix = os.path.join(self.dir, _prefix(self.i, self.n))
+
+    def select(self, paths):
+        """Keep this shard's share of `paths` (which must be in the deterministic sorted order)."""
+        mine = []
+        for pos, path in enumerate(paths):
+            if self.by == "name" and pos % self.n != self.i - 1:
+                continue   # by name, only this shard's own files need reading
+            digest = file_sha256(path)
+            if shard_of(pos, digest, self.n, self.by) == self.i - 1:
+                name = os.path.basename(path)
+                self.files[name] = {"file": name, "sha256": digest, "bytes": os.path.getsize(path),
+                                    "turns": None, "score_s": None, "status": "pending", "error": None}
+                mine.append(path)
+        print(f"Shard {self.i}/{self.n} (by {self.by}): {len(mine)} of {len(paths)} file(s).")
+        return mine
+
+    def add_rows(self, path, df, score_s):
+        """Append one file's scored turns to the shard's rows CSV (streamed, not held in memory)."""
+        name = os.path.basename(path)
+        entry = self.files[name]
+        entry["turns"], entry["score_s"] = len(df), round(score_s, 6)
+        if not len(df):
+            return
+        if self._rows_w is None:
+            self._rows_f = open(self.prefix + "_rows.csv", "w", newline="", encoding="utf-8")
+            self._rows_w = csv.DictWriter(self._rows_f, fieldnames=["source_file"] + list(df.columns),
+                                          extrasaction="ignore")
+            self._rows_w.writeheader()
+        for rec in df.to_dict("records"):
+            rec["source_file"] = name
+            self._rows_w.writerow(rec)
+
+    def record(self, path, stage, err):
+        entry = self.files[os.path.basename(path)]
+        entry["status"] = "ok" if err is None else f"{stage}_failed"
+        entry["error"] = None if err is None else str(err)
+
+    def finish(self, summary_rows):
+        if self._rows_f is not None:
+            self._rows_f.close()
+        else:  # nothing scored: leave an empty rows file so merge still finds one per shard
+            open(self.prefix + "_rows.csv", "w", encoding="utf-8").close()
+        with open(self.prefix + "_summary.csv", "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=core.CORPUS_SUMMARY_FIELDS, extrasaction="ignore")
+            w.writeheader()
+            for row in sorted(summary_rows, key=lambda r: r["file"]):
+                w.writerow(row)
+        manifest = {
+            "shard": self.i, "of": self.n, "by": self.by,
+            "config_version": self.config_version,
+            "host": socket.gethostname(),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "wall_s": round(time.perf_counter() - self.t0, 3),
+            "turns": sum(e["turns"] or 0 for e in self.files.values()),
+            "files": sorted(self.files.values(), key=lambda e: e["file"]),
+            "outputs": {"rows": os.path.basename(self.prefix + "_rows.csv"),
+                        "summary": os.path.basename(self.prefix + "_summary.csv")},
+        }
+        with open(self.prefix + "_manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        print(f"Shard {self.i}/{self.n} done -> {self.prefix}_manifest.json")
+        return manifest
+
+# -----------------------------
+# Merge
+# -----------------------------
+def load_manifests(shards_dir):
+    out = []
+    for fname in sorted(os.listdir(shards_dir)):
+        if fname.endswith("_manifest.json"):
+            with open(os.path.join(shards_dir, fname), "r", encoding="utf-8") as f:
+                out.append(json.load(f))
+    return out
+
+def verify(manifests, input_folder=None):
+    """Return a list of problems (empty = complete and consistent)."""
+    problems = []
+    if not manifests:
+        return ["no shard manifests found"]
+    for key in ("of", "by", "config_version"):
+        vals = {m[key] for m in manifests}
+        if len(vals) > 1:
+            problems.append(f"shards disagree on {key}: {sorted(map(str, vals))}")
+    n = manifests[0]["of"]
+    seen_shards = [m["shard"] for m in manifests]
+    missing = sorted(set(range(1, n + 1)) - set(seen_shards))
+    if missing:
+        problems.append(f"missing shard(s): {missing} of {n}")
+    dup_shards = sorted({s for s in seen_shards if seen_shards.count(s) > 1})
+    if dup_shards:
+        problems.append(f"shard(s) reported more than once: {dup_shards}")
+
+    owner = {}
+    for m in manifests:
+        for e in m["files"]:
+            if e["file"] in owner:
+                problems.append(f"{e['file']} appears in shards {owner[e['file']]['shard']} and {m['shard']}")
+            owner[e["file"]] = dict(e, shard=m["shard"])
+            if e["status"] != "ok":
+                problems.append(f"{e['file']} (shard {m['shard']}): {e['status']} {e.get('error') or ''}".rstrip())
+
+    if input_folder is not None:
+        for path in core.list_input_files(input_folder):
+            name = os.path.basename(path)
+            if name not in owner:
+                problems.append(f"{name} is in {input_folder} but in no shard")
+            elif owner[name]["sha256"] != file_sha256(path):
+                problems.append(f"{name} changed since shard {owner[name]['shard']} scored it")
+    return problems
+
+def merge(shards_dir, out_folder, input_folder=None, allow_incomplete=False):
+    manifests = sorted(load_manifests(shards_dir), key=lambda m: m["shard"])
+    problems = verify(manifests, input_folder)
+    report = {"shards": [m["shard"] for m in manifests], "of": manifests[0]["of"] if manifests else None,
+              "config_version": manifests[0]["config_version"] if manifests else None,
+              "files": sum(len(m["files"]) for m in manifests),
+              "turns": sum(m["turns"] for m in manifests),
+              "shard_wall_s": {m["shard"]: m["wall_s"] for m in manifests},
+              "problems": problems, "complete": not problems}
+    for p in problems:
+        print(f"[MERGE] {p}")
+    if problems and not allow_incomplete:
+        print("[MERGE] Not writing merged outputs (use --allow-incomplete to override).")
+        return report
+
+    os.makedirs(out_folder, exist_ok=True)
+    header, n_rows = None, 0
+    tmp = os.path.join(out_folder, CORPUS_DATASET + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as out:
+        w = csv.writer(out)
+        for m in manifests:
+            with open(os.path.join(shards_dir, m["outputs"]["rows"]), newline="", encoding="utf-8") as f:
+                r = csv.reader(f)
+                h = next(r, None)
+                if h is None:
+                    continue
+                if header is None:
+                    header = h
+                    w.writerow(header)
+                elif h != header:
+                    raise ValueError(f"shard {m['shard']} rows have different columns; rerun with the same options")
+                for row in r:
+                    w.writerow(row); n_rows += 1
+    os.replace(tmp, os.path.join(out_folder, CORPUS_DATASET))
+
+    summary_rows = []
+    for m in manifests:
+        with open(os.path.join(shards_dir, m["outputs"]["summary"]), newline="", encoding="utf-8") as f:
+            summary_rows.extend(csv.DictReader(f))
+    core.write_corpus_summary(summary_rows, out_folder)
+
+    report["dataset_rows"] = n_rows
+    with open(os.path.join(out_folder, MERGE_REPORT), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Merged {len(manifests)} shard(s): {report['files']} file(s), {n_rows} turn(s) -> "
+          f"{os.path.join(out_folder, CORPUS_DATASET)}")
+    return report
+
+def merge_main(argv=None):
+    ap = argparse.ArgumentParser(prog="convo_metrics_batch_v4.py merge",
+                                 description="Combine shard outputs into the corpus dataset and summary.")
+    ap.add_argument("--shards-dir", default=os.path.join(core.OUTPUT_FOLDER, SHARDS_DIR),
+                    help="folder holding every shard's *_manifest.json / *_rows.csv / *_summary.csv")
+    ap.add_argument("--out", default=core.OUTPUT_FOLDER, help="where to write the merged files (default ./output)")
+    ap.add_argument("--input", default=None, help="also check that every file in this folder was scored, unchanged")
+    ap.add_argument("--allow-incomplete", action="store_true", help="write merged outputs even if checks fail")
+    args = ap.parse_args(argv)
+    report = merge(args.shards_dir, args.out, args.input, args.allow_incomplete)
+    return 0 if report["complete"] else 1
@@ -0,0 +1,189 @@
+# convo_metrics_sweep.py — weight/threshold sweeps over already-scored components
+# Reads the metrics sheets the batch script / GUI wrote (IA, ST, AC, SC, SN, CP and the
+# prompt-shuffle SN/CP), and evaluates thousands of E-score weightings and hot thresholds
+# as one matrix multiply — no rescoring of the transcripts.
+#
+#   python convo_metrics_sweep.py                         # ./output, 0.05 simplex grid, thresholds 0.40..0.70
+#   python convo_metrics_sweep.py --random 5000 --thresholds 0.5,0.55,0.6 --out sweep.csv
+#
+# Per (weights, threshold) it reports hot share (real and control), E mean, E-minus-control
+# delta, and rank stability vs. the shipped weights (Spearman over turns + top-decile overlap).
+# Note: E is recomputed from the stored 3-decimal components, so the baseline row can differ
+# from the stored E_score in the last digit.
+
+import os, sys, glob, argparse, itertools
+
+import numpy as np
+import pandas as pd
+
+import convo_metrics_batch_v4 as core
+
+COMPONENTS      = ["IA_initiative", "ST_synthesis", "AC_affect", "SC_self_continuity", "SN_norm_novelty", "CP_coherence_penalty"]
+CTRL_COMPONENTS = ["IA_initiative", "ST_synthesis", "AC_affect", "SC_self_continuity", "SN_prompt_shuffle", "CP_prompt_shuffle"]
+WEIGHT_NAMES    = ["w_IA", "w_ST", "w_AC", "w_SC", "w_SN"]
+CELL_BUDGET     = 2_000_000  # N x k cells per working matrix; a chunk holds ~6 of them (~100 MB total)
+
+# -----------------------------
+# Loading stored components
+# -----------------------------
+def _with_control_components(df):
+    """Fill SN/CP_prompt_shuffle from the stored text when a workbook predates those columns."""
+    if all(c in df.columns for c in ("SN_prompt_shuffle", "CP_prompt_shuffle")):
+        return df
+    ctrl = core.negative_control_prompt_shuffle(df.reset_index(drop=True), components=True)
+    if ctrl is None:
+        return df
+    df = df.reset_index(drop=True).drop(columns=[c for c in ctrl.columns if c in df.columns])
+    return pd.concat([df, ctrl], axis=1)
+
+def load_components(folder):
+    """Concatenate every *_results.xlsx metrics sheet (or *_metrics.csv) in folder."""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(folder, "*_results.xlsx"))):
+        frames.append((path, pd.read_excel(path, sheet_name="metrics")))
+    for path in sorted(glob.glob(os.path.join(folder, "*_metrics.csv"))):
+        frames.append((path, pd.read_csv(path)))
+    out = []
+    for path, df in frames:
+        if df.empty or not all(c in df.columns for c in COMPONENTS):
+            print(f"[WARN] {os.path.basename(path)}: no scored rows, skipped.")
+            continue
+        df = _with_control_components(df)
+        df.insert(0, "source_file", os.path.basename(path))
+        out.append(df)
+    if not out:
+        raise SystemExit(f"No scored metrics found in {folder!r}.")
+    return pd.concat(out, ignore_index=True)
+
+# -----------------------------
+# Weight vectors
+# -----------------------------
+def simplex_grid(step, total=1.0):
+    """All 5-weight vectors on a grid of `step` that sum to `total`."""
+    n = int(round(total / step))
+    out = []
+    for cuts in itertools.combinations(range(n + 4), 4):
+        parts = np.diff((-1,) + cuts + (n + 4,)) - 1
+        out.append(parts * step)
+    return np.array(out, dtype=float)
+
+def random_weights(k, seed=core.RANDOM_SEED, total=1.0):
+    return np.random.default_rng(seed).dirichlet(np.ones(5), size=k) * total
+
+def weights_from_csv(path):
+    return pd.read_csv(path)[WEIGHT_NAMES].to_numpy(dtype=float)
+
+# -----------------------------
+# Sweep
+# -----------------------------
+def _round3(E):
+    return np.maximum(0.0, np.round(E, 3))
+
+def _ranks(M):
+    """Column-wise average ranks of an N x K matrix (ties share their mean rank).
+
+    E is clipped and rounded, so ties are common; ordinal ranks would break them by row order
+    and make tied configs look more stable than they are.
+    """
+    return pd.DataFrame(M).rank(method="average").to_numpy()
+
+def _top_mask(M, top_n, M_sorted=None):
+    """N x K mask of each column's top decile: everything >= the top_n-th largest value, ties included."""
+    if M_sorted is None:
+        M_sorted = np.sort(M, axis=0)
+    return M >= M_sorted[M.shape[0] - top_n]
+
+def _hot_share(M_sorted, thresholds):
+    """K x T share of each (ascending-sorted) column at or above each threshold."""
+    N = M_sorted.shape[0]
+    return np.array([N - np.searchsorted(M_sorted[:, j], thresholds, side="left")
+                     for j in range(M_sorted.shape[1])]).reshape(M_sorted.shape[1], len(thresholds)) / N
+
+def sweep(X, Xc, weights, thresholds, cp_scale=1.0, chunk=None):
+    """Evaluate every weight vector x threshold.
+
+    X, Xc: N x 6 component matrices (real and prompt-shuffle control), CP last.
+    weights: K x 5. Row 0 should be the baseline — rank stability is measured against it.
+    chunk: weight vectors per matrix multiply; by default CELL_BUDGET // N, so memory stays
+    bounded however many turns are loaded.
+    Returns a DataFrame with K * len(thresholds) rows.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    W = np.hstack([weights, np.full((len(weights), 1), -cp_scale)])   # K x 6
+    N = X.shape[0]
+    top_n = max(1, N // 10)
+    chunk = chunk or max(1, CELL_BUDGET // max(1, N))
+
+    base = _round3(X @ W[:1].T)[:, 0]
+    base_rank = _ranks(base[:, None])[:, 0]
+    base_rank_c = base_rank - base_rank.mean()
+    base_top = _top_mask(base[:, None], top_n)[:, 0]
+
+    results = []
+    for start in range(0, len(W), chunk):
+        Wk = W[start:start + chunk]
+        E  = _round3(X @ Wk.T)      # N x k
+        Ec = _round3(Xc @ Wk.T)
+        E_mean, Ec_mean = E.mean(axis=0), Ec.mean(axis=0)
+        Es = np.sort(E, axis=0)
+        hot  = _hot_share(Es, thresholds)                  # k x T
+        hotc = _hot_share(np.sort(Ec, axis=0), thresholds)
+
+        R = _ranks(E)
+        Rc = R - R.mean(axis=0)
+        denom = np.sqrt((Rc ** 2).sum(axis=0) * (base_rank_c ** 2).sum())
+        spearman = np.where(denom > 0, (Rc * base_rank_c[:, None]).sum(axis=0) / np.where(denom > 0, denom, 1), np.nan)
+        # tied top sets can be larger than top_n; dividing by the larger set means an all-tied
+        # column scores chance (~top_n/N) instead of a perfect overlap
+        tops = _top_mask(E, top_n, Es)
+        overlap = (tops & base_top[:, None]).sum(axis=0) / np.maximum(tops.sum(axis=0), base_top.sum())
+
+        for j in range(E.shape[1]):
+            for t_i, t in enumerate(thresholds):
+                results.append((start + j, *Wk[j, :5], cp_scale, t,
+                                hot[j, t_i], hotc[j, t_i], E_mean[j], Ec_mean[j], E_mean[j] - Ec_mean[j],
+                                spearman[j], overlap[j]))
+
+    cols = (["config"] + WEIGHT_NAMES + ["cp_scale", "threshold", "hot_share", "hot_share_ctrl",
+            "E_mean", "ctrl_mean", "delta_E_minus_ctrl", "rank_spearman_vs_base", "top_decile_overlap"])
+    return pd.DataFrame(results, columns=cols).round(4)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sweep E-score weights and hot thresholds over stored components.")
+    ap.add_argument("--input", default=core.OUTPUT_FOLDER, help="folder with *_results.xlsx / *_metrics.csv (default: ./output)")
+    gen = ap.add_mutually_exclusive_group()
+    gen.add_argument("--grid", type=float, default=0.05, metavar="STEP", help="simplex grid step (default 0.05)")
+    gen.add_argument("--random", type=int, default=None, metavar="K", help="K random (Dirichlet) weight vectors instead")
+    gen.add_argument("--weights", default=None, metavar="CSV", help="CSV with columns " + ",".join(WEIGHT_NAMES))
+    ap.add_argument("--total", type=float, default=1.0, help="sum of the five weights (default 1.0, as shipped)")
+    ap.add_argument("--cp-scale", type=float, default=1.0, help="multiplier on the coherence penalty (default 1.0)")
+    ap.add_argument("--thresholds", default="0.40,0.45,0.50,0.55,0.60,0.65,0.70")
+    ap.add_argument("--seed", type=int, default=core.RANDOM_SEED)
+    ap.add_argument("--out", default=None, help="output CSV (default: <input>/weight_sweep.csv)")
+    ap.add_argument("--top", type=int, default=10, help="print this many configs with the largest E-minus-control delta")
+    args = ap.parse_args(argv)
+
+    df = load_components(args.input)
+    X  = df[COMPONENTS].to_numpy(dtype=float)
+    Xc = df[CTRL_COMPONENTS].to_numpy(dtype=float)
+
+    if args.weights:
+        weights = weights_from_csv(args.weights)
+    elif args.random is not None:
+        weights = random_weights(args.random, seed=args.seed, total=args.total)
+    else:
+        weights = simplex_grid(args.grid, total=args.total)
+    weights = np.vstack([np.array(core.E_WEIGHTS, dtype=float), weights])   # config 0 = shipped weights
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+
+    res = sweep(X, Xc, weights, thresholds, cp_scale=args.cp_scale)
+    out = args.out or os.path.join(args.input, "weight_sweep.csv")
+    res.to_csv(out, index=False)
+
+    print(f"{len(df)} turns from {df['source_file'].nunique()} file(s); "
+          f"{len(weights)} weight vectors x {len(thresholds)} thresholds -> {out}")
+    at_hot = res[np.isclose(res["threshold"], core.HOT_THRESHOLD)] if core.HOT_THRESHOLD in thresholds else res
+    print(at_hot.sort_values("delta_E_minus_ctrl", ascending=False).head(args.top).to_string(index=False))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# convo_metrics_watch.py — watch-folder mode for the batch script (`--watch`)
+# Scores new or modified .txt/.docx/.json files in the input folder as they land, through a worker
+# pool, and keeps each workbook plus output/corpus_summary.csv up to date. Files still being
+# written are debounced (must stay unchanged for `debounce` seconds); unchanged content (same hash)
+# is never rescored, including across restarts (output/.watch_state.json).
+# Change detection uses inotify on Linux (via ctypes, no extra dependency) and falls back to polling.
+
+import os, sys, csv, json, time, select, struct, hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import convo_metrics_batch_v4 as core
+
+STATE_FILE = ".watch_state.json"
+
+# -----------------------------
+# Change sources
+# -----------------------------
+class PollWatcher:
+    """Rescans the folder every `interval` seconds; reports names whose (size, mtime) changed."""
+
+    def __init__(self, folder, interval=1.0):
+        self.folder = folder
+        self.interval = interval
+        self.snapshot = {}
+
+    def changes(self):
+        time.sleep(self.interval)
+        changed, current = set(), {}
+        with os.scandir(self.folder) as it:
+            for e in it:
+                if e.is_file() and e.name.lower().endswith(core.SUPPORTED_EXTS):
+                    st = e.stat()
+                    current[e.name] = (st.st_size, st.st_mtime_ns)
+                    if self.snapshot.get(e.name) != current[e.name]:
+                        changed.add(e.name)
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """inotify(7) through ctypes. Raises OSError where inotify is unavailable."""
+
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, folder, timeout=1.0):
+        import ctypes, ctypes.util
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is Linux-only")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {folder}")
+        self.timeout = timeout
+
+    def changes(self):
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not ready:
+            return set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names, off = set(), 0
+        while off + self._EVENT.size <= len(buf):
+            _wd, _mask, _cookie, length = self._EVENT.unpack_from(buf, off)
+            off += self._EVENT.size
+            name = os.fsdecode(buf[off:off + length].rstrip(b"\0"))
+            off += length
+            if name.lower().endswith(core.SUPPORTED_EXTS):
+                names.add(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(folder, poll=1.0):
+    try:
+        return InotifyWatcher(folder, timeout=min(1.0, poll))
+    except (OSError, AttributeError) as e:
+        print(f"[INFO] inotify unavailable ({e}); polling every {poll}s.")
+        return PollWatcher(folder, interval=poll)
+
+# -----------------------------
+# State helpers
+# -----------------------------
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+def _load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _save_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def _load_corpus_rows(out_folder):
+    path = os.path.join(out_folder, core.CORPUS_SUMMARY)
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return {r["file"]: r for r in csv.DictReader(f)}
+    except OSError:
+        return {}
+
+# -----------------------------
+# Watch loop
+# -----------------------------
+def _rescore(path, out_folder, profile, index):
+    """analyze_file, after dropping the file's previous version from the history index."""
+    if index is not None:
+        index.forget(os.path.basename(path))
+    return core.analyze_file(path, out_folder, profile, index)
+
+def watch(in_folder, out_folder, workers=1, debounce=2.0, poll=1.0, profile=False, index=None):
+    """Run until interrupted. Files already in the folder are scored first if new or changed."""
+    state_path = os.path.join(out_folder, STATE_FILE)
+    state = _load_json(state_path, {})                 # name -> content sha1 of the last scored version
+    corpus_rows = _load_corpus_rows(out_folder)        # name -> corpus_summary row
+    if index is not None:
+        # the index lives in memory only: rebuild it from the whole folder, in sorted order, on startup
+        state = {}
+        if workers:
+            print("[INFO] --minhash keeps one shared index, so scoring runs in-process (workers=0).")
+            workers = 0
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else ThreadPoolExecutor(max_workers=1)
+
+    pending = {}   # name -> (stat key, time it was last seen changing)
+    running = {}   # name -> (future, sha1); a file changed mid-run stays in `pending` and is rechecked after
+
+    def touch(name):
+        path = os.path.join(in_folder, name)
+        try:
+            key = _stat_key(path)
+        except OSError:
+            pending.pop(name, None)  # deleted or renamed away
+            return
+        if pending.get(name, (None,))[0] != key:
+            pending[name] = (key, time.monotonic())
+
+    watcher = make_watcher(in_folder, poll)
+    for path in core.list_input_files(in_folder):
+        touch(os.path.basename(path))
+    print(f"Watching {os.path.abspath(in_folder)} -> {os.path.abspath(out_folder)} (Ctrl+C to stop)")
+
+    try:
+        while True:
+            for name in watcher.changes():
+                touch(name)
+
+            # debounce: a file is ready once its size/mtime held still for `debounce` seconds
+            now = time.monotonic()
+            for name in list(pending):
+                if name in running:
+                    continue
+                touch(name)
+                if name not in pending:
+                    continue
+                if now - pending[name][1] < debounce:
+                    continue
+                del pending[name]
+                path = os.path.join(in_folder, name)
+                try:
+                    digest = _file_hash(path)
+                except OSError:
+                    continue
+                if state.get(name) == digest:
+                    continue
+                running[name] = (pool.submit(_rescore, path, out_folder, profile, index), digest)
+
+            changed = False
+            for name, (fut, digest) in list(running.items()):
+                if not fut.done():
+                    continue
+                del running[name]
+                try:
+                    corpus_rows[name] = fut.result()
+                    state[name] = digest
+                    changed = True
+                except Exception as e:
+                    print(f"[WARN] Skipped {name}: {e}")
+            if changed:
+                core.write_corpus_summary(corpus_rows.values(), out_folder)
+                _save_json(state_path, state)
+    except KeyboardInterrupt:
+        print("Stopping watch.")
+    finally:
+        watcher.close()
+        pool.shutdown(wait=True, cancel_futures=True)
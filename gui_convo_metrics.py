@@ -1,18 +1,22 @@
 # gui_convo_metrics_plus.py — paste-or-drop GUI for convo metrics (ChatGPT + Claude)
 # Now supports .txt, .docx (Word), and .json conversation exports.
-# Requires: pandas, openpyxl. Optional: tkinterdnd2 for drag & drop of files. For .docx: pip install python-docx
-# It imports processing from convo_metrics_batch_v4.py (same folder).
+# Requires: pandas, openpyxl. Optional: tkinterdnd2 for drag & drop of files. (.docx is read without python-docx.)
+# It imports processing and the file readers from convo_metrics_batch_v4.py (same folder).
 
-import os, sys, time, re, json
+import os, sys, time, re
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:   # annotations only; pandas itself is imported lazily
+    import pandas as pd
 
 OUTPUT_FOLDER = "output"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # ---- Try to import processing from the batch script ----
 try:
-    from convo_metrics_batch_v4 import process_conversation, negative_control_prompt_shuffle, HOT_THRESHOLD
+    from convo_metrics_batch_v4 import process_conversation, negative_control_prompt_shuffle, HOT_THRESHOLD, read_convo_from_path, run_pipeline
 except Exception as e:
     try:
         messagebox.showerror("Import Error", "Couldn't import convo_metrics_batch_v4.py: {}\nPut this GUI file in the same folder as convo_metrics_batch_v4.py.".format(e))
@@ -20,103 +24,12 @@ except Exception as e:
         print("[Import Error] Couldn't import convo_metrics_batch_v4.py:", e)
     raise
 
-import pandas as pd
-
-# ---- helpers to read convo text from multiple formats ----
-
-def _read_txt(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
-def _read_docx(path: str) -> str:
-    try:
-        from docx import Document
-    except Exception as e:
-        raise RuntimeError("python-docx is required for .docx files. Install with: pip install python-docx") from e
-    doc = Document(path)
-    paras = []
-    for p in doc.paragraphs:
-        paras.append(p.text)
-    text = "\n".join(paras).strip()
-    return text
-
-def _flatten_openai_contents(content):
-    """OpenAI JSON may have content as string or list of {'type':'text','text':...} blocks."""
-    if isinstance(content, str):
-        return content
-    if isinstance(content, list):
-        out = []
-        for part in content:
-            if isinstance(part, dict):
-                # 'text' for text blocks; assist if name differs
-                if 'text' in part and isinstance(part['text'], str):
-                    out.append(part['text'])
-                elif 'image_url' in part:
-                    out.append("[image]")
-        return "\n".join(out)
-    if isinstance(content, dict) and 'text' in content:
-        return content.get('text','')
-    return str(content)
-
-ROLE_MAP = {
-    'user':'User', 'human':'User', 'system':'User', # treat system as user context
-    'assistant':'Assistant', 'claude':'Assistant', 'model':'Assistant'
-}
-
-def _read_json(path: str) -> str:
-    """Best-effort loader for common ChatGPT/Claude exports.
-    Produces a normalized plain text with explicit headers like 'User:' / 'Assistant:' so the downstream parser works.
-    """
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    lines = []
-
-    # Case 1: {'messages': [...]} like OpenAI
-    msgs = None
-    if isinstance(data, dict) and isinstance(data.get('messages'), list):
-        msgs = data['messages']
-    elif isinstance(data, list) and data and isinstance(data[0], dict) and 'messages' in data[0]:
-        msgs = data[0]['messages']
-    elif isinstance(data, list):
-        # sometimes the root is already a list of message dicts
-        if all(isinstance(m, dict) and ('role' in m or 'sender' in m) for m in data):
-            msgs = data
-
-    if msgs is not None:
-        for m in msgs:
-            role = m.get('role') or m.get('sender') or m.get('author')
-            role_norm = ROLE_MAP.get(str(role).lower(), 'User' if str(role).lower() in ('system',) else 'Assistant' if str(role).lower() in ('assistant','claude','model') else 'User')
-            content = m.get('content')
-            text = _flatten_openai_contents(content)
-            header = 'User:' if role_norm == 'User' else 'Assistant:'
-            lines.append(f"{header} {text}")
-        return "\n".join(lines)
-
-    # Case 2: Anthropic-style {'type':'message','role':'assistant','content':...}
-    if isinstance(data, dict) and data.get('type') == 'message' and 'role' in data and 'content' in data:
-        role_norm = ROLE_MAP.get(str(data.get('role')).lower(), 'Assistant')
-        text = _flatten_openai_contents(data.get('content'))
-        header = 'Assistant:' if role_norm == 'Assistant' else 'User:'
-        return f"{header} {text}"
-
-    # Case 3: Unknown structure — fallback to raw dump
-    return json.dumps(data, ensure_ascii=False, indent=2)
-
-
-def read_convo_from_path(path: str) -> str:
-    ext = os.path.splitext(path)[1].lower()
-    if ext == '.txt':
-        return _read_txt(path)
-    if ext == '.docx':
-        return _read_docx(path)
-    if ext == '.json':
-        return _read_json(path)
-    raise ValueError("Unsupported file type: {}".format(ext))
+# pandas is imported inside the functions that need it, so the window comes up without paying for it.
 
 # ---- Excel writer helper ----
 
-def write_workbook(df: pd.DataFrame, base_name: str) -> str:
+def write_workbook(df: "pd.DataFrame", base_name: str) -> str:
+    import pandas as pd
     # --- defensive checks ---
     if "E_score" not in df.columns:
         raise KeyError("Missing E_score column — parsing likely failed. Make sure the text has clear User/Assistant turns.")
@@ -198,6 +111,11 @@ def write_workbook(df: pd.DataFrame, base_name: str) -> str:
         print(f"[WARN] Excel write failed ({e}). Wrote CSVs instead.")
     return out_xlsx
 
+def write_scored(result):
+    """Writer stage for run_pipeline: result is (base_name, df). Module-level so writer processes can run it."""
+    base_name, df = result
+    return write_workbook(df, base_name)
+
 # ---- GUI ----
 
 class App:
@@ -273,6 +191,7 @@ class App:
     # --- Buttons ---
     def process_pasted(self):
         import traceback
+        import pandas as pd
         txt = self.text.get("1.0", tk.END).strip()
         if not txt:
             messagebox.showinfo("Nothing to do", "Paste some text first.")
@@ -284,7 +203,7 @@ class App:
             df = process_conversation(txt)
             if "E_score" not in df.columns:
                 raise KeyError("Missing E_score — check transcript headers.")
-            ctrl = negative_control_prompt_shuffle(df)
+            ctrl = negative_control_prompt_shuffle(df, components=True)
             if ctrl is not None:
                 df = pd.concat([df, ctrl], axis=1)
             base = time.strftime("pasted_%Y%m%d_%H%M%S")
@@ -312,25 +231,42 @@ class App:
 
     def process_files(self, files):
         import traceback
+        import pandas as pd
+
+        position = {path: i for i, path in enumerate(files, 1)}
+
+        def score(path, text):
+            # runs on this (UI) thread, one file at a time, while earlier workbooks are still being written
+            self.status.configure(text=f"Processing {position[path]}/{len(files)}: {os.path.basename(path)}…")
+            self.root.update_idletasks()
+            df = process_conversation(text)
+            if "E_score" not in df.columns:
+                raise KeyError("Missing E_score for {} — check transcript structure.".format(os.path.basename(path)))
+            ctrl = negative_control_prompt_shuffle(df, components=True)
+            if ctrl is not None:
+                df = pd.concat([df, ctrl], axis=1)
+            return os.path.splitext(os.path.basename(path))[0], df
+
         self.disable_ui()
         try:
             last_out = None
-            for i, path in enumerate(files, 1):
-                self.status.configure(text=f"Processing {i}/{len(files)}: {os.path.basename(path)}…")
-                self.root.update_idletasks()
-                try:
-                    text = read_convo_from_path(path)
-                except Exception as read_err:
-                    messagebox.showwarning("Skip", "Could not read {}: {}".format(os.path.basename(path), read_err))
-                    continue
-                df = process_conversation(text)
-                if "E_score" not in df.columns:
-                    raise KeyError("Missing E_score for {} — check transcript structure.".format(os.path.basename(path)))
-                ctrl = negative_control_prompt_shuffle(df)
-                if ctrl is not None:
-                    df = pd.concat([df, ctrl], axis=1)
-                base = os.path.splitext(os.path.basename(path))[0]
-                last_out = write_workbook(df, base)
+            self.status.configure(text=f"Processing {len(files)} file(s)…")
+            self.root.update_idletasks()
+            # workbooks are written in background processes while the next file is scored
+            stages = run_pipeline(files, read=read_convo_from_path, score=score,
+                                  write=write_scored, processes=True)
+            try:
+                for i, (path, stage, out, err) in enumerate(stages, 1):
+                    if stage == "read":
+                        messagebox.showwarning("Skip", "Could not read {}: {}".format(os.path.basename(path), err))
+                        continue
+                    if err is not None:
+                        raise err
+                    last_out = out
+                    self.status.configure(text=f"Done {i}/{len(files)}: {os.path.basename(path)}")
+                    self.root.update_idletasks()
+            finally:
+                stages.close()   # stops the pipeline's reader thread if we bailed out early
             if last_out:
                 messagebox.showinfo("Done", f"Processed {len(files)} file(s). Last output: {os.path.basename(last_out)}")
                 self.clear_box()